@@ -1,7 +1,32 @@
+import asyncio
+import base64
+import copy
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+import orjson
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from starlette.status import HTTP_401_UNAUTHORIZED
+from starlette.requests import Request
+from starlette.status import (
+    HTTP_200_OK,
+    HTTP_400_BAD_REQUEST,
+    HTTP_401_UNAUTHORIZED,
+    HTTP_404_NOT_FOUND,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+)
 
+from titan import database
 from titan.app import app
+from titan.auth import get_current_active_user
+from titan.database import get_connection
+from titan.manager import WorkflowManager
+from titan.models.user import UserInDB
+from titan.models.workflow import State, WorkflowInDB
+from titan.routes.v2 import workflow as w_v2
+from titan.routes.v3 import workflow as w_v3
 
 client = TestClient(app)
 
@@ -10,3 +35,341 @@ def test_cannot_create_new_workflow_if_unauthenticated():
     response = client.post("/api/v2/workflow/new")
     assert response.status_code == HTTP_401_UNAUTHORIZED
     assert response.json() == {"detail": "Not authenticated"}
+
+
+class _FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self.documents.sort(key=lambda document: document[key], reverse=direction < 0)
+        return self
+
+    def skip(self, skips):
+        self.documents = self.documents[skips:]
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    def batch_size(self, size):
+        pass
+
+    async def to_list(self, length):
+        documents, self.documents = self.documents[:length], self.documents[length:]
+        return documents
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+
+class _FakeCollection:
+    """Serves documents from memory, recording the queries and projections it receives."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = []
+
+    def find(self, query, projection):
+        self.queries.append((query, projection))
+        excluded = [key for key, value in projection.items() if not value]
+        return _FakeCursor([_project(document, excluded) for document in self.documents if _matches(document, query)])
+
+    async def count_documents(self, query):
+        return sum(_matches(document, query) for document in self.documents)
+
+    async def update_one(self, query, update):
+        for document in self.documents:
+            if _matches(document, query):
+                document.update(update["$set"])
+                return
+
+
+def _project(document, excluded):
+    document = copy.deepcopy(document)
+    for key in excluded:
+        *parents, last = key.split(".")
+        parent = document
+        for part in parents:
+            parent = parent.get(part) or {}
+        parent.pop(last, None)
+    return document
+
+
+def _field(document, key: str):
+    for part in key.split("."):
+        document = document.get(part) if isinstance(document, dict) else None
+    return document
+
+
+_OPERATORS = {
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+
+
+def _matches(document, query) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(document, alternative) for alternative in condition):
+                return False
+        elif key == "$and":
+            if not all(_matches(document, alternative) for alternative in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not all(_OPERATORS[op](_field(document, key), operand) for op, operand in condition.items()):
+                return False
+        elif _field(document, key) != condition:
+            return False
+    return True
+
+
+def _find_all(documents, after=None):
+    db = SimpleNamespace(workflow=_FakeCollection(documents))
+
+    async def collect():
+        return [workflow.id async for workflow in WorkflowManager().find_all(db, username="user", after=after)]
+
+    return asyncio.run(collect())
+
+
+def _workflow_document(workflow_id: str, updated_at):
+    return {"id": workflow_id, "metadata": {"author": "user"}, "updated_at": updated_at}
+
+
+@pytest.mark.parametrize(
+    "updated_at", [datetime(2021, 5, 1, 12, 30, tzinfo=timezone.utc), "2021-05-01T12:30:00"], ids=["date", "string"]
+)
+def test_cursor_roundtrip(updated_at):
+    workflow = WorkflowInDB.construct(id="wf_1", updated_at=updated_at)
+
+    assert w_v3._decode_cursor(w_v3._encode_cursor(workflow)) == (updated_at, "wf_1")
+
+
+def test_cursor_pages_workflows_updated_at_same_time():
+    updated_at = datetime(2021, 5, 1, tzinfo=timezone.utc)
+    documents = [_workflow_document(workflow_id, updated_at) for workflow_id in ("wf_1", "wf_2", "wf_3")]
+    documents.append(_workflow_document("wf_0", datetime(2021, 4, 1, tzinfo=timezone.utc)))
+
+    first_page = _find_all(documents)[:2]
+    last_seen = WorkflowInDB.construct(id=first_page[-1], updated_at=updated_at)
+    next_page = _find_all(documents, after=w_v3._decode_cursor(w_v3._encode_cursor(last_seen)))
+
+    assert first_page == ["wf_3", "wf_2"]
+    assert next_page == ["wf_1", "wf_0"]
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor",
+        base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+        base64.urlsafe_b64encode(b"{}").decode(),
+        base64.urlsafe_b64encode(b'["wf_1"]').decode(),
+        base64.urlsafe_b64encode(b'[1, "wf_1"]').decode(),
+        base64.urlsafe_b64encode(b'[{"$date": 0}, 1]').decode(),
+    ],
+)
+def test_fstatus_rejects_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        w_v3._decode_cursor(cursor)
+
+    app.dependency_overrides[get_connection] = lambda: None
+    try:
+        response = client.get("/api/v3/workflow/fstatus", params={"username": "user", "cursor": cursor})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+# last known statuses stored in database, and the current ones in DRAMA: wf_5 finished since its status was stored,
+# wf_4 was executed before statuses were stored and wf_0 was never executed
+_STORED_STATUSES = {"wf_5": "RUNNING", "wf_4": None, "wf_3": "DONE", "wf_2": "RUNNING", "wf_1": "DONE", "wf_0": None}
+_STATUSES = {"wf_5": "DONE", "wf_4": "DONE", "wf_3": "DONE", "wf_2": "RUNNING", "wf_1": "DONE", "wf_0": None}
+
+
+def _stored_workflows():
+    updated_at = datetime(2021, 5, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "id": workflow_id,
+            "operators": {},
+            "links": {},
+            "created_at": updated_at,
+            "updated_at": updated_at,
+            "metadata": {"author": "user", "name": "demo"},
+            "executed": f"exec_{workflow_id}" if _STATUSES[workflow_id] else None,
+            **({"status": status} if status else {}),
+        }
+        for workflow_id, status in _STORED_STATUSES.items()
+    ]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Database holding the stored workflows, with DRAMA answering their current statuses."""
+    fake = SimpleNamespace(workflow=_FakeCollection(_stored_workflows()))
+
+    async def status(self, workflow):
+        return {"tasks": [{"name": "task", "status": _STATUSES[workflow.id]}]}, 200
+
+    monkeypatch.setattr(WorkflowManager, "status", status)
+
+    async def get_user(db, username):
+        return UserInDB.construct(username=username)
+
+    monkeypatch.setattr(w_v3, "get_cached_user_by_username", get_user)
+    app.dependency_overrides[get_connection] = lambda: fake
+    app.dependency_overrides[get_current_active_user] = lambda: UserInDB.construct(username="user")
+    yield fake
+    app.dependency_overrides.clear()
+
+
+def _stored_statuses(db) -> dict:
+    return {document["id"]: document.get("status") for document in db.workflow.documents}
+
+
+def _read_ndjson(response) -> list:
+    """Reads a streamed response body, checking that it is framed as one JSON document per line."""
+    assert response.media_type == "application/x-ndjson"
+
+    async def read():
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(read())
+    assert all(chunk.endswith(b"\n") and chunk.count(b"\n") == 1 for chunk in chunks)
+    return [orjson.loads(chunk) for chunk in chunks]
+
+
+def _request(path: str, params: dict) -> Request:
+    query_string = urlencode(params, doseq=True).encode()
+    return Request({"type": "http", "method": "GET", "path": path, "headers": [], "query_string": query_string})
+
+
+# streaming responses are read from the endpoints directly, as they are not supported by the test client
+# in every version of python this project runs on
+
+
+def test_get_all_stream_matches_get_all(db):
+    response = asyncio.run(w_v2.get_all_stream(current_user=UserInDB.construct(username="user"), db=db))
+    streamed = _read_ndjson(response)
+
+    listed = client.get("/api/v2/workflow/get/all", params={"page_size": 100})
+
+    assert listed.status_code == HTTP_200_OK
+    assert [workflow["id"] for workflow in streamed] == ["wf_5", "wf_4", "wf_3", "wf_2", "wf_1", "wf_0"]
+    assert streamed == listed.json()["workflows"]
+
+
+@pytest.mark.parametrize("with_status", ["DONE", "RUNNING", "UNKNOWN"])
+@pytest.mark.parametrize(
+    "params",
+    [
+        {},
+        {"metadata.name": "demo"},
+        {"metadata.name": "other"},
+        {"exclude_key": ["operators", "links", "tasks", "metadata"]},
+        {"exclude_key": ["id", "updated_at", "executed", "status", "metadata.name"]},
+    ],
+)
+def test_fstatus_stream_matches_fstatus(db, with_status, params):
+    params = {"username": "user", "with_status": with_status, **params}
+    exclude_key = params.get("exclude_key", ["operators", "links"])
+
+    response = asyncio.run(
+        w_v3.fstatus_stream(
+            _request("/api/v3/workflow/fstatus/stream", params),
+            username="user",
+            exclude_key=exclude_key,
+            with_status=State(with_status),
+            db=db,
+        )
+    )
+    streamed = _read_ndjson(response)
+    streamed_queries, db.workflow.queries = db.workflow.queries, []
+
+    listed = client.get("/api/v3/workflow/fstatus", params={**params, "page_size": 100})
+
+    # same workflows in the same order, with the same fields left out
+    if streamed:
+        assert listed.status_code == HTTP_200_OK
+        assert streamed == listed.json()["workflows"]
+    else:
+        assert listed.status_code == HTTP_404_NOT_FOUND
+    assert all(workflow["status"] == with_status for workflow in streamed)
+    # same filters sent to the database, always reading the fields statuses and cursors depend on
+    assert streamed_queries == db.workflow.queries
+    assert all(not {"id", "updated_at", "executed", "status"} & set(projection) for _, projection in streamed_queries)
+
+
+@pytest.mark.parametrize(
+    "with_status, expected",
+    [("DONE", ["wf_5", "wf_4", "wf_3", "wf_1"]), ("RUNNING", ["wf_2"]), ("UNKNOWN", ["wf_0"])],
+)
+def test_fstatus_matches_current_statuses(db, with_status, expected):
+    params = {"username": "user", "with_status": with_status, "page_size": 2}
+    seen, cursor = [], None
+    while True:
+        response = client.get("/api/v3/workflow/fstatus", params={**params, "cursor": cursor} if cursor else params)
+        assert response.status_code == HTTP_200_OK
+        page = response.json()
+        seen.append([workflow["id"] for workflow in page["workflows"]])
+        cursor = page["pagination"]["next_cursor"]
+        if not cursor:
+            break
+
+    # pages are full, and outdated or missing statuses are matched on their current value
+    assert [workflow_id for page in seen for workflow_id in page] == expected
+    assert all(len(page) == 2 for page in seen[:-1])
+    # refreshed statuses are stored
+    assert _stored_statuses(db)["wf_5"] == "DONE"
+    assert _stored_statuses(db)["wf_4"] == "DONE"
+
+
+def test_fstatus_pages_by_number_after_refreshing_statuses(db):
+    params = {"username": "user", "with_status": "DONE", "page_size": 3}
+
+    first = client.get("/api/v3/workflow/fstatus", params={**params, "page_num": 1}).json()
+    last = client.get("/api/v3/workflow/fstatus", params={**params, "page_num": 2}).json()
+    past = client.get("/api/v3/workflow/fstatus", params={**params, "page_num": 3})
+
+    assert [workflow["id"] for workflow in first["workflows"]] == ["wf_5", "wf_4", "wf_3"]
+    assert first["pagination"]["next_cursor"] and first["pagination"]["total_count"] is None
+    assert [workflow["id"] for workflow in last["workflows"]] == ["wf_1"]
+    assert last["pagination"]["next_cursor"] is None
+    assert (last["pagination"]["total_count"], last["pagination"]["page_count"]) == (4, 2)
+    assert past.status_code == HTTP_404_NOT_FOUND
+
+
+def test_backfill_statuses_of_workflows_executed_before_they_were_stored(db, monkeypatch):
+    monkeypatch.setattr(database.db, "client", SimpleNamespace(titan=db))
+
+    asyncio.run(database.backfill_statuses())
+
+    # only missing statuses are backfilled, outdated ones are refreshed when listed
+    assert _stored_statuses(db) == {**_STORED_STATUSES, "wf_4": "DONE"}
+
+
+@pytest.mark.parametrize("exclude_key", [[""], ["unknown"], ["operators", "metadata."]])
+@pytest.mark.parametrize("path", ["/api/v3/workflow/status", "/api/v3/workflow/fstatus"])
+def test_status_rejects_invalid_exclude_keys(db, path, exclude_key):
+    response = client.get(path, params={"username": "user", "exclude_key": exclude_key})
+
+    assert response.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+    assert db.workflow.queries == []
+
+
+def test_fstatus_stream_rejects_invalid_exclude_keys(db):
+    request = _request("/api/v3/workflow/fstatus/stream", {"username": "user", "exclude_key": "unknown"})
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(
+            w_v3.fstatus_stream(request, username="user", exclude_key=["unknown"], with_status=State.STATUS_DONE, db=db)
+        )
+    assert excinfo.value.status_code == HTTP_422_UNPROCESSABLE_ENTITY
@@ -1,7 +1,10 @@
+import copy
+
+import pytest
 import rdflib
 from rdflib import RDF
 
-from titan.models.workflow import WorkflowRequest, parse_to_list, parse_to_rdf
+from titan.models.workflow import WorkflowRequest, parse_to_list, parse_to_rdf, parse_to_rdf_nt
 
 _workflow = {
     "operators": {
@@ -154,3 +157,25 @@ def test_parsed_to_rdf():
         rdflib.term.URIRef("http://www.khaos.uma.es/perception/bigowl#hasComponent"),
         rdflib.term.URIRef("https://www.w3.org/#Component1"),
     ) in result
+
+
+@pytest.mark.parametrize(
+    "uri",
+    [
+        "http://x/a> . } } ; DROP ALL ; INSERT DATA { GRAPH <g> { <http://x/b",
+        "http://x/a b",
+        'http://x/a"b',
+        "http://x/a\nb",
+    ],
+)
+def test_parsed_to_rdf_rejects_invalid_uri(uri):
+    workflow = copy.deepcopy(_workflow)
+    workflow["operators"]["op_0"]["definition"]["uri"] = uri
+
+    with pytest.raises(ValueError):
+        parse_to_rdf_nt(workflow, workflow_id="test-1-1")
+
+
+def test_parsed_to_rdf_rejects_invalid_workflow_id():
+    with pytest.raises(ValueError):
+        parse_to_rdf_nt(_workflow, workflow_id="x> . <y")
@@ -0,0 +1,369 @@
+import asyncio
+
+import httpcore
+import httpx
+import pytest
+
+from titan.semantic.repository import RDFBatchWriter, RDFRepository, Virtuoso, _normalize, _parse_csv
+
+
+class _FakeStore:
+    database = "http://g"
+
+    def __init__(self, fail_on=(), delay: float = 0):
+        self.fail_on = fail_on
+        self.delay = delay
+        self.updates = []
+
+    async def update(self, query: str, invalidate: bool = True) -> None:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if any(block in query for block in self.fail_on):
+            raise RuntimeError("Bad request")
+        self.updates.append(query)
+
+
+def test_batch_writer_writes_right_away_until_started():
+    store = _FakeStore()
+    writer = RDFBatchWriter(store)
+
+    asyncio.run(writer.put("<a> <b> <c> .\n"))
+
+    assert store.updates == ["INSERT DATA { GRAPH <http://g> {<a> <b> <c> .\n} }"]
+
+
+def test_batch_writer_batches_blocks():
+    store = _FakeStore()
+    writer = RDFBatchWriter(store, max_batch_size=2, flush_interval=10)
+
+    async def scenario():
+        await writer.start()
+        for block in ("1", "2", "3"):
+            await writer.put(block)
+        await asyncio.sleep(0.01)
+        # first batch is full, the last block waits for the flush interval
+        assert store.updates == ["INSERT DATA { GRAPH <http://g> {12} }"]
+        await writer.close()
+
+    asyncio.run(scenario())
+
+    assert store.updates == ["INSERT DATA { GRAPH <http://g> {12} }", "INSERT DATA { GRAPH <http://g> {3} }"]
+
+
+def test_batch_writer_flushes_after_interval():
+    store = _FakeStore()
+    writer = RDFBatchWriter(store, max_batch_size=100, flush_interval=0.01)
+
+    async def scenario():
+        await writer.start()
+        await writer.put("1")
+        await asyncio.sleep(0.05)
+        assert store.updates == ["INSERT DATA { GRAPH <http://g> {1} }"]
+        await writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_batch_writer_writes_pending_blocks_on_close():
+    store = _FakeStore()
+    writer = RDFBatchWriter(store, max_batch_size=100, flush_interval=10)
+
+    async def scenario():
+        await writer.start()
+        await writer.put("1")
+        await writer.put("2")
+        await writer.close()
+        # once closed, blocks are written right away
+        await writer.put("3")
+
+    asyncio.run(scenario())
+
+    assert store.updates == ["INSERT DATA { GRAPH <http://g> {12} }", "INSERT DATA { GRAPH <http://g> {3} }"]
+
+
+def test_batch_writer_close_is_bounded():
+    store = _FakeStore(delay=1)
+    writer = RDFBatchWriter(store, max_batch_size=1, flush_interval=10, close_timeout=0.05)
+
+    async def scenario():
+        await writer.start()
+        await writer.put("1")
+        await writer.put("2")
+        await writer.close()
+
+    asyncio.run(scenario())
+
+    assert store.updates == []
+
+
+def test_batch_writer_writes_blocks_one_by_one_if_batch_fails():
+    store = _FakeStore(fail_on=("bad",))
+    writer = RDFBatchWriter(store, max_batch_size=3, flush_interval=10)
+
+    async def scenario():
+        await writer.start()
+        for block in ("1", "bad", "3"):
+            await writer.put(block)
+        await writer.close()
+
+    asyncio.run(scenario())
+
+    assert store.updates == ["INSERT DATA { GRAPH <http://g> {1} }", "INSERT DATA { GRAPH <http://g> {3} }"]
+
+
+
+def test_batch_writer_flushes_on_demand():
+    store = _FakeStore()
+    writer = RDFBatchWriter(store, max_batch_size=100, flush_interval=10)
+
+    async def scenario():
+        await writer.start()
+        await writer.put("1")
+        await writer.put("2")
+        await writer.flush()
+        assert store.updates == ["INSERT DATA { GRAPH <http://g> {12} }"]
+        await writer.put("3")
+        await writer.close()
+
+    asyncio.run(scenario())
+
+    assert store.updates == ["INSERT DATA { GRAPH <http://g> {12} }", "INSERT DATA { GRAPH <http://g> {3} }"]
+
+
+def test_batch_writer_waits_for_room_in_queue():
+    store = _FakeStore(delay=0.1)
+    writer = RDFBatchWriter(store, max_batch_size=1, flush_interval=10, max_queue_size=1)
+
+    async def scenario():
+        await writer.start()
+        await writer.put("1")
+        # first block is being written, the second one fills up the queue
+        await asyncio.sleep(0.01)
+        await writer.put("2")
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(writer.put("3"), 0.02)
+        await writer.close()
+
+    asyncio.run(scenario())
+
+    assert store.updates == ["INSERT DATA { GRAPH <http://g> {1} }", "INSERT DATA { GRAPH <http://g> {2} }"]
+
+
+def test_batch_writer_close_is_bounded_with_full_queue():
+    store = _FakeStore(delay=1)
+    writer = RDFBatchWriter(store, max_batch_size=1, flush_interval=10, close_timeout=0.05, max_queue_size=1)
+
+    async def scenario():
+        await writer.start()
+        await writer.put("1")
+        await asyncio.sleep(0.01)
+        await writer.put("2")
+        await asyncio.wait_for(writer.close(), 0.5)
+
+    asyncio.run(scenario())
+
+    assert store.updates == []
+
+class _FakeTransport(httpcore.AsyncHTTPTransport):
+    """Answers every request with the next of the given status codes, recording the requests it receives."""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+
+    async def arequest(self, method, url, headers=None, stream=None, ext=None):
+        self.requests.append((method.decode(), b"".join([chunk async for chunk in stream]).decode()))
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        if isinstance(status, Exception):
+            raise status
+        body = b'{"results": {"bindings": [{"s": {"value": "ok"}}]}}' if status < 400 else b"error"
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        return status, headers, httpcore.PlainByteStream(body), {}
+
+
+# templates are formatted with the query parameters, braces are escaped
+_QUERY = "SELECT ?s WHERE {{ ?s ?p ?o }}"
+
+
+def _virtuoso(endpoint: str, transport: _FakeTransport, database: str = "http://g") -> Virtuoso:
+    store = Virtuoso(endpoint, database, transport=transport)
+    store.RETRY_BACKOFF = 0
+    return store
+
+
+@pytest.mark.parametrize(
+    "query, normalized",
+    [
+        ("SELECT ?s\n  WHERE {\n\t?s ?p ?o . # any triple\n}\n", "SELECT ?s WHERE { ?s ?p ?o . }"),
+        ("SELECT ?p WHERE { <http://x#y> ?p ?o }  # by subject", "SELECT ?p WHERE { <http://x#y> ?p ?o }"),
+        ('SELECT ?s WHERE { ?s ?p "a # b" }', 'SELECT ?s WHERE { ?s ?p "a # b" }'),
+        ("SELECT ?s WHERE { ?s ?p 'a  #  b' }", "SELECT ?s WHERE { ?s ?p 'a  #  b' }"),
+        (r'SELECT ?s WHERE { ?s ?p "say \"hi\" # there" } # end', r'SELECT ?s WHERE { ?s ?p "say \"hi\" # there" }'),
+        (
+            'INSERT DATA { <a> <b> """first line\n  # second "line"\n\nthird""" } # end',
+            'INSERT DATA { <a> <b> """first line\n  # second "line"\n\nthird""" }',
+        ),
+        ("INSERT DATA { <a> <b> '''it's\n  #  here''' }", "INSERT DATA { <a> <b> '''it's\n  #  here''' }"),
+    ],
+)
+def test_normalize_keeps_literals_and_iris(query, normalized):
+    assert _normalize(query) == normalized
+
+
+def test_query_results_are_cached_until_updated_through_any_instance():
+    transport = _FakeTransport(200)
+    reader = _virtuoso("http://cache/sparql", transport)
+    writer = _virtuoso("http://cache/sparql", transport)
+    other_graph = _virtuoso("http://cache/sparql", transport, database="http://other")
+
+    async def scenario():
+        await reader.query(_QUERY)
+        await other_graph.query(_QUERY)
+        await reader.query(_QUERY)
+        assert len(transport.requests) == 2
+
+        await writer.update("INSERT DATA { <a> <b> <c> }")
+        await reader.query(_QUERY)
+        await other_graph.query(_QUERY)
+
+        for store in (reader, writer, other_graph):
+            await store.aclose()
+
+    asyncio.run(scenario())
+
+    # only results from the updated graph are invalidated
+    assert [method for method, _ in transport.requests] == ["GET", "GET", "POST", "GET"]
+
+
+def test_workflow_writes_keep_ontology_query_results():
+    transport = _FakeTransport(200)
+    ontology = _virtuoso("http://ontology/sparql", transport)
+    store = _virtuoso("http://ontology/sparql", transport)
+    writer = RDFBatchWriter(store)
+
+    async def scenario():
+        await ontology.query(_QUERY)
+        await writer.put("<http://w> <http://p> <http://o> .\n")
+        await ontology.query(_QUERY)
+        # workflow data is read uncached, so it never goes stale
+        await ontology.query(_QUERY, cache=False)
+        await ontology.query(_QUERY, cache=False)
+
+        for repository in (ontology, store):
+            await repository.aclose()
+
+    asyncio.run(scenario())
+
+    assert [method for method, _ in transport.requests] == ["GET", "POST", "GET", "GET"]
+
+def test_failed_query_results_are_not_cached():
+    transport = _FakeTransport(400, 200)
+    store = _virtuoso("http://failures/sparql", transport)
+
+    async def scenario():
+        results = [await store.query(_QUERY) for _ in range(3)]
+        await store.aclose()
+        return results
+
+    assert asyncio.run(scenario()) == [{}, [{"s": {"value": "ok"}}], [{"s": {"value": "ok"}}]]
+    assert len(transport.requests) == 2
+
+
+@pytest.mark.parametrize(
+    "statuses, requests, result",
+    [
+        ((503, 502, 200), 3, [{"s": {"value": "ok"}}]),
+        ((httpcore.ConnectError(), 200), 2, [{"s": {"value": "ok"}}]),
+        ((503,), Virtuoso.MAX_QUERY_ATTEMPTS, {}),
+        ((400,), 1, {}),
+        ((404, 200), 1, {}),
+    ],
+    ids=["server-errors", "transport-error", "exhausted", "bad-request", "not-found"],
+)
+def test_queries_retry_server_errors_only(statuses, requests, result):
+    transport = _FakeTransport(*statuses)
+    store = _virtuoso(f"http://retries-{len(statuses)}-{statuses[0]!r}/sparql", transport)
+
+    async def scenario():
+        results = await store.query(_QUERY)
+        await store.aclose()
+        return results
+
+    assert asyncio.run(scenario()) == result
+    assert len(transport.requests) == requests
+
+
+def test_long_queries_are_retried_as_forms():
+    transport = _FakeTransport(503, 200)
+    store = _virtuoso("http://retries-form/sparql", transport)
+
+    query = "SELECT ?s WHERE {{ VALUES ?s {{ {values} }} }}"
+    values = " ".join(f"<http://x/{i}>" for i in range(Virtuoso.MAX_GET_QUERY_LENGTH))
+
+    async def scenario():
+        results = await store.query(query, values=values)
+        await store.aclose()
+        return results
+
+    assert asyncio.run(scenario()) == [{"s": {"value": "ok"}}]
+    assert [method for method, _ in transport.requests] == ["POST", "POST"]
+
+
+def test_updates_are_not_retried():
+    transport = _FakeTransport(503, 200)
+    store = _virtuoso("http://retries-update/sparql", transport)
+
+    async def scenario():
+        try:
+            await store.update("INSERT DATA { <a> <b> <c> }")
+        finally:
+            await store.aclose()
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(scenario())
+    assert len(transport.requests) == 1
+
+
+class _FakeRepository(RDFRepository):
+    def __init__(self):
+        super().__init__("http://batches/sparql", "http://g")
+        self.batches = []
+
+    async def query(self, query: str, result_format: str = "json", cache: bool = True, **params):
+        iris = params["values"][1:-1].split("> <")
+        self.batches.append(iris)
+        # two rows per IRI, e.g., one per label
+        return [{"s": {"value": iri}, "label": {"value": label}} for iri in iris for label in ("a", "b")]
+
+    async def update(self, query: str, invalidate: bool = True) -> None:
+        pass
+
+
+@pytest.mark.parametrize("count, batch_sizes", [(0, []), (1, [1]), (50, [50]), (51, [50, 1]), (120, [50, 50, 20])])
+def test_query_batched_groups_rows_by_iri(count, batch_sizes):
+    repository = _FakeRepository()
+    iris = [f"http://x/{i}" for i in range(count)]
+
+    rows_by_iri = asyncio.run(repository.query_batched("SELECT ...", variable="s", iris=iris))
+
+    assert [len(batch) for batch in repository.batches] == batch_sizes
+    assert [iri for batch in repository.batches for iri in batch] == iris
+    assert list(rows_by_iri) == iris
+    assert all([row["label"]["value"] for row in rows_by_iri[iri]] == ["a", "b"] for iri in iris)
+
+
+@pytest.mark.parametrize(
+    "text, bindings",
+    [
+        ("", []),
+        ("s,label\r\n", []),
+        ("s,label\r\nhttp://x/1,one\r\n", [{"s": {"value": "http://x/1"}, "label": {"value": "one"}}]),
+        ('s,label\r\nhttp://x/1,"one, two"\r\n', [{"s": {"value": "http://x/1"}, "label": {"value": "one, two"}}]),
+        ('s,label\r\nhttp://x/1,"say ""hi"""\r\n', [{"s": {"value": "http://x/1"}, "label": {"value": 'say "hi"'}}]),
+        ('s,label\r\nhttp://x/1,"two\nlines"\r\n', [{"s": {"value": "http://x/1"}, "label": {"value": "two\nlines"}}]),
+        ("s,label\r\nhttp://x/1,\r\n,one\r\n", [{"s": {"value": "http://x/1"}}, {"label": {"value": "one"}}]),
+    ],
+    ids=["empty", "no-rows", "plain", "comma", "quotes", "newline", "unbound"],
+)
+def test_parse_csv(text, bindings):
+    assert _parse_csv(text) == bindings
@@ -1,15 +1,22 @@
-import uvicorn
 from fastapi import Depends, FastAPI
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.models import APIKey
 from fastapi.openapi.utils import get_openapi
+from fastapi.responses import ORJSONResponse
 from starlette import status
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse, Response
+from starlette.responses import Response
 
 from titan import __version__
 from titan.config import settings
 from titan.database import close_db_connection, create_db_connection
+from titan.manager import (
+    close_drama_connection,
+    close_store_connection,
+    close_store_writer,
+    create_drama_connection,
+    start_store_writer,
+)
 from titan.routes.v2 import semantic, user
 from titan.routes.v2 import workflow as w_v2
 from titan.routes.v3 import workflow as w_v3
@@ -40,6 +47,7 @@ app = FastAPI(
     openapi_url=None,
     openapi_tags=tags_metadata,
     root_path=settings.ROOT_PATH,
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -59,8 +67,14 @@ app.add_middleware(
 
 # app.add_event_handler("startup", configure_logging)
 app.add_event_handler("startup", create_db_connection)
+app.add_event_handler("startup", create_drama_connection)
+app.add_event_handler("startup", start_store_writer)
 
 app.add_event_handler("shutdown", close_db_connection)
+app.add_event_handler("shutdown", close_drama_connection)
+app.add_event_handler("shutdown", close_store_writer)
+app.add_event_handler("shutdown", close_store_connection)
+app.add_event_handler("shutdown", semantic.close_ontology_connection)
 
 
 # api routes
@@ -82,7 +96,7 @@ app.include_router(semantic.router, prefix="/api/v2/semantic")
 
 @app.get("/api/openapi.json", tags=["documentation"])
 async def get_open_api_endpoint(api_key: APIKey = Depends(get_api_key)):
-    response = JSONResponse(
+    response = ORJSONResponse(
         get_openapi(
             title="TITAN API SERVICES",
             version=__version__,
@@ -103,6 +117,8 @@ async def get_documentation(api_key: APIKey = Depends(get_api_key)):
 
 
 def run_server():
+    import uvicorn
+
     uvicorn.run(
         app,
         host=settings.API_HOST,
@@ -1,7 +1,10 @@
+import functools
+import time
 from datetime import datetime, timedelta
 from typing import Union
 
 import jwt
+from aiocache import cached
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jwt import PyJWTError
@@ -29,6 +32,14 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None) -> str:
     return encoded_jwt
 
 
+@functools.lru_cache(maxsize=1024)
+def _decode_token(token: str) -> dict:
+    """
+    Verifies and decodes a JWT. Results are cached by raw token, so the expiration must be checked again on use.
+    """
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+
 async def get_user_by_username(db: AsyncIOMotorClient, username: str) -> UserInDB:
     """
     Gets user from database.
@@ -38,6 +49,16 @@ async def get_user_by_username(db: AsyncIOMotorClient, username: str) -> UserInD
         return UserInDB(**user)
 
 
+@cached(ttl=60, key_builder=lambda f, db, username: f"user:{username}")
+async def get_cached_user_by_username(db: AsyncIOMotorClient, username: str) -> UserInDB:
+    """
+    Gets user from database, caching it for a minute. Users not found are not cached.
+
+    Users deleted or changed in the meantime may still be returned, so it is only meant for read-only routes.
+    """
+    return await get_user_by_username(db, username)
+
+
 async def get_user_by_email(db: AsyncIOMotorClient, email: str) -> UserInDB:
     """
     Gets user from database.
@@ -80,7 +101,9 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
+        if "exp" in payload and payload["exp"] < time.time():
+            raise credentials_exception
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -31,6 +31,10 @@ class _Settings(BaseSettings):
     RDF_REPOSITORY_USERNAME = "admin"
     RDF_REPOSITORY_PASSWORD = "password"
     RDF_REPOSITORY_DB = "default"
+    # multiplexes concurrent queries over a single connection, requires `httpx[http2]`
+    RDF_REPOSITORY_HTTP2: bool = False
+    # either "digest" or "basic"
+    RDF_REPOSITORY_AUTH_SCHEME: str = "digest"
 
     # workflow orchestrator
     DRAMA_HOST: str = "localhost"
@@ -44,6 +48,8 @@ class _Settings(BaseSettings):
             "endpoint": self.RDF_REPOSITORY_ENDPOINT,
             "username": self.RDF_REPOSITORY_USERNAME,
             "password": self.RDF_REPOSITORY_PASSWORD,
+            "http2": self.RDF_REPOSITORY_HTTP2,
+            "auth_scheme": self.RDF_REPOSITORY_AUTH_SCHEME,
         }
 
     class Config:
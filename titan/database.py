@@ -1,7 +1,12 @@
+import asyncio
+from datetime import datetime
+
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from titan.config import settings
 from titan.logger import get_logger
+from titan.manager import WorkflowManager
+from titan.models.workflow import WorkflowInDB, derive_status
 
 logger = get_logger(__name__)
 
@@ -15,7 +20,89 @@ db = DataBase()
 
 async def create_db_connection():
     logger.debug("Connecting to database for the first time")
-    db.client = AsyncIOMotorClient(settings.MONGO_DNS)
+    # datetimes are stored as BSON dates (UTC) and read back as timezone-aware objects
+    db.client = AsyncIOMotorClient(settings.MONGO_DNS, tz_aware=True)
+    await create_indexes()
+    await migrate_timestamps()
+    await backfill_statuses()
+
+
+async def create_indexes():
+    """
+    Ensures indexes backing the workflow queries exist.
+    """
+    workflow = db.client.titan.workflow
+    # lookups by id
+    await workflow.create_index("id", unique=True)
+    # listings by author, sorted by last update (id breaks ties for cursor pagination)
+    await workflow.create_index([("metadata.author", 1), ("updated_at", -1), ("id", -1)])
+    # listings by author and materialized execution status
+    await workflow.create_index([("metadata.author", 1), ("status", 1), ("updated_at", -1), ("id", -1)])
+
+
+async def migrate_timestamps():
+    """
+    Converts workflow timestamps stored as ISO strings by older versions into BSON dates, so that they sort along
+    with the newer ones. Runs on every startup, but only documents still holding strings are touched.
+    """
+    workflow = db.client.titan.workflow
+    # old timestamps were naive and written in the server's local time
+    utc_offset = datetime.now().astimezone().strftime("%z")
+    for field in ("created_at", "updated_at"):
+        result = await workflow.update_many(
+            {field: {"$type": "string"}},
+            [
+                {
+                    "$set": {
+                        field: {
+                            "$dateFromString": {
+                                # dates have millisecond precision, drop the remaining digits of the microseconds
+                                "dateString": {"$substrCP": [f"${field}", 0, 23]},
+                                "timezone": utc_offset,
+                                # leave unparseable values as they are rather than failing the whole update
+                                "onError": f"${field}",
+                            }
+                        }
+                    }
+                }
+            ],
+        )
+        if result.modified_count:
+            logger.info(f"Converted {field} of {result.modified_count} workflows to dates")
+
+
+async def backfill_statuses(batch_size: int = 16):
+    """
+    Stores the execution status of workflows executed before it was kept along with them, fetching it from DRAMA.
+    Runs on every startup, but only executed workflows still without one are touched. Those left out, e.g., because
+    DRAMA is not reachable, are refreshed instead whenever they are listed by status.
+    """
+    workflow_manager = WorkflowManager()
+
+    async def _backfill(workflow: WorkflowInDB) -> bool:
+        response, status_code = await workflow_manager.status(workflow)
+        if status_code != 200:
+            return False
+        tasks_statuses = [task.get("status").upper() for task in response["tasks"]]
+        await workflow_manager.save_status(
+            db.client.titan, workflow, derive_status(tasks_statuses, is_revoked=response.get("is_revoked"))
+        )
+        return True
+
+    query = {"executed": {"$ne": None}, "status": None}
+    cursor = db.client.titan.workflow.find(query, {"_id": 0, "id": 1, "executed": 1})
+    backfilled = 0
+    try:
+        while True:
+            documents = await cursor.to_list(length=batch_size)
+            if not documents:
+                break
+            results = await asyncio.gather(*(_backfill(WorkflowInDB.construct(**document)) for document in documents))
+            backfilled += sum(results)
+    except Exception:
+        logger.exception("Could not backfill workflow statuses, they will be refreshed when listed")
+    if backfilled:
+        logger.info(f"Stored the status of {backfilled} workflows executed before it was kept")
 
 
 async def close_db_connection():
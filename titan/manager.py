@@ -1,57 +1,121 @@
-import json
-import uuid
-from datetime import datetime
+import asyncio
+import functools
+import secrets
+from datetime import datetime, timezone
 from typing import List, Optional, Tuple
 
 import httpx
+import orjson
+from fastapi.concurrency import run_in_threadpool
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from titan.config import settings
 from titan.logger import get_logger
 from titan.models.workflow import (
+    State,
     WorkflowInDB,
     WorkflowRequest,
     parse_to_list,
-    parse_to_rdf,
+    parse_to_rdf_nt,
 )
-from titan.semantic.repository import Virtuoso
+from titan.semantic.repository import RDFBatchWriter, Virtuoso
 
 logger = get_logger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def get_store() -> Virtuoso:
+    """
+    Returns the RDF store client, created on first use rather than at import time.
+    """
+    return Virtuoso(**settings.rdf_connection_settings)
+
+
+@functools.lru_cache(maxsize=None)
+def get_store_writer() -> RDFBatchWriter:
+    """
+    Returns the writer batching workflows' RDF into the store, created on first use rather than at import time.
+    """
+    return RDFBatchWriter(get_store())
+
+
 class _DramaAsyncClient:
 
     api_endpoint = f"http://{settings.DRAMA_HOST}:{settings.DRAMA_PORT}"
     api_token = settings.DRAMA_TOKEN
 
+    client: httpx.AsyncClient = None
+
+    @classmethod
+    def _get_client(cls) -> httpx.AsyncClient:
+        """
+        Returns the shared client, so that connections to DRAMA are pooled and kept alive across requests.
+        """
+        if cls.client is None:
+            cls.client = httpx.AsyncClient(
+                base_url=cls.api_endpoint,
+                headers={"x-token": cls.api_token},
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+        return cls.client
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls.client is not None:
+            await cls.client.aclose()
+            cls.client = None
+
     @classmethod
     async def get(cls, resource: str) -> (dict, int):
         logger.debug(f"Accessing {cls.api_endpoint}{resource}")
-        async with httpx.AsyncClient() as client:
-            req = await client.get(f"{cls.api_endpoint}{resource}", headers={"x-token": cls.api_token})
+        req = await cls._get_client().get(resource)
         res, status = {}, req.status_code
         if not req.is_error:
-            res = req.json()
+            res = orjson.loads(req.content)
         return res, status
 
     @classmethod
     async def post(cls, resource: str, data: dict = None) -> (dict, int):
-        def serializer(o):
-            if isinstance(o, datetime):
-                return o.isoformat()
-
-        async with httpx.AsyncClient() as client:
-            req = await client.post(
-                f"{cls.api_endpoint}{resource}",
-                headers={"x-token": cls.api_token},
-                data=json.dumps(data, default=serializer) if data else None,
-            )
+        # orjson natively serializes datetime objects as RFC 3339 strings
+        req = await cls._get_client().post(
+            resource,
+            headers={"content-type": "application/json"},
+            content=orjson.dumps(data) if data else None,
+        )
         res, status = {}, req.status_code
         if not req.is_error:
-            res = req.json()
+            res = orjson.loads(req.content)
         return res, status
 
 
+async def create_drama_connection():
+    logger.debug("Connecting to DRAMA for the first time")
+    _DramaAsyncClient._get_client()
+
+
+async def close_drama_connection():
+    logger.debug("Closing connection with DRAMA")
+    await _DramaAsyncClient.close()
+
+
+async def start_store_writer():
+    logger.debug("Starting RDF batch writer")
+    await get_store_writer().start()
+
+
+async def close_store_writer():
+    # nothing to flush if the writer was never used
+    if get_store_writer.cache_info().currsize:
+        logger.debug("Flushing and stopping RDF batch writer")
+        await get_store_writer().close()
+
+
+async def close_store_connection():
+    if get_store.cache_info().currsize:
+        logger.debug("Closing connection with RDF store")
+        await get_store().aclose()
+
+
 class WorkflowManager:
     async def execute(self, db: AsyncIOMotorClient, workflow: WorkflowInDB) -> Tuple[dict, int]:
         """
@@ -80,17 +144,26 @@ class WorkflowManager:
         if status == 200:
             # update last execution id
             execution_id = req["id"]
-            await db.workflow.update_one({"id": workflow.id}, {"$set": {"executed": execution_id}}, upsert=True)
+            await db.workflow.update_one(
+                {"id": workflow.id},
+                {"$set": {"executed": execution_id, "status": State.STATUS_PENDING.value}},
+                upsert=True,
+            )
+            # keep caller's copy in sync, so it does not have to be read again
+            workflow.executed = execution_id
+            workflow.status = State.STATUS_PENDING
 
         return req, status
 
-    async def revoke(self, workflow: WorkflowInDB) -> Tuple[dict, int]:
+    async def revoke(self, db: AsyncIOMotorClient, workflow: WorkflowInDB) -> Tuple[dict, int]:
         """
         :param db: Database client connection.
         :param workflow: Workflow stored in database.
         """
         last_exec_id = workflow.executed
         req, status = await _DramaAsyncClient.post(f"/api/v2/workflow/revoke?id={last_exec_id}")
+        if status == 200:
+            await self.save_status(db, workflow, State.STATUS_REVOKED)
         return req, status
 
     async def status(self, workflow: WorkflowInDB) -> Tuple[dict, int]:
@@ -101,6 +174,20 @@ class WorkflowManager:
         req, status = await _DramaAsyncClient.get(f"/api/v2/workflow/status?id={last_exec_id}")
         return req, status
 
+    async def save_status(self, db: AsyncIOMotorClient, workflow: WorkflowInDB, status: State) -> None:
+        """
+        Stores last known execution status of workflow, so that it can be read without querying DRAMA.
+
+        DRAMA does not notify task status changes, so this is a cache rather than the current status: terminal
+        statuses hold until the workflow is executed again, but any other may have changed since it was stored.
+
+        :param db: Database client connection.
+        :param workflow: Workflow stored in database.
+        :param status: Execution status.
+        """
+        await db.workflow.update_one({"id": workflow.id}, {"$set": {"status": State(status).value}})
+        workflow.status = status
+
     async def insert(
         self,
         db: AsyncIOMotorClient,
@@ -117,8 +204,8 @@ class WorkflowManager:
         :param workflow_id: Unique workflow identifier.
         """
         if not workflow_id:
-            workflow_id = str(uuid.uuid4().hex)
-        workflow.created_at = datetime.now().isoformat()
+            workflow_id = secrets.token_hex(16)
+        workflow.created_at = datetime.now(timezone.utc)
         return await self.upsert(db, username, workflow_id, workflow)
 
     async def upsert(
@@ -132,33 +219,38 @@ class WorkflowManager:
         :param workflow_id: Unique workflow identifier.
         :param workflow: Workflow request from user.
         """
-        workflow.updated_at = datetime.now().isoformat()
+        workflow.updated_at = datetime.now(timezone.utc)
 
         # append some metadata
         workflow_as_dict = workflow.dict(exclude_none=True)
         workflow_as_dict["metadata"]["author"] = username
 
         # upsert -> if the record does not exist, insert it
-        await db.workflow.update_one({"id": workflow_id}, {"$set": workflow_as_dict}, upsert=True)
+        # both writes are independent, so rdf is inserted to repository meanwhile
+        await asyncio.gather(
+            db.workflow.update_one({"id": workflow_id}, {"$set": workflow_as_dict}, upsert=True),
+            self._store_rdf(workflow_as_dict, workflow_id),
+        )
 
-        # insert rdf to repository
-        try:
-            workflow_rdf = parse_to_rdf(workflow_as_dict, workflow_id=workflow_id)
-            workflow_rdf_as_nt = workflow_rdf.serialize(format="nt")
+        return WorkflowInDB(id=workflow_id, **workflow_as_dict)
 
-            logger.debug(f"Workflow {workflow_id} correctly parsed as {workflow_rdf_as_nt}")
+    async def _store_rdf(self, workflow_as_dict: dict, workflow_id: str) -> None:
+        """
+        Inserts workflow's RDF to repository. Failures are logged but otherwise ignored.
 
-            triples = str(workflow_rdf_as_nt.decode("UTF-8"))
+        :param workflow_as_dict: Workflow as stored in database.
+        :param workflow_id: Unique workflow identifier.
+        """
+        try:
+            # serialization is cpu-bound, keep it off the event loop
+            triples = await run_in_threadpool(parse_to_rdf_nt, workflow_as_dict, workflow_id=workflow_id)
 
-            store = Virtuoso(**settings.rdf_connection_settings)
-            query = "INSERT DATA { GRAPH <" + store.database + "> {" + triples + "} }"
+            logger.debug(f"Workflow {workflow_id} correctly parsed as {triples}")
 
-            await store.update(query)
+            await get_store_writer().put(triples)
         except Exception as err:
             logger.exception(f"Could not store workflow's RDF: {err.args[0]}")
 
-        return WorkflowInDB(id=workflow_id, **workflow_as_dict)
-
     async def find_one(self, db: AsyncIOMotorClient, username: str, workflow_id: str) -> WorkflowInDB:
         """
         Find workflow in database from current user given its id.
@@ -171,20 +263,53 @@ class WorkflowManager:
         if workflow:
             return WorkflowInDB(**workflow)
 
-    async def find_all(self, db: AsyncIOMotorClient, username: str, **kwargs):
+    async def exists(self, db: AsyncIOMotorClient, username: str, workflow_id: str) -> bool:
         """
-        Find workflows in database.
+        Checks whether workflow exists in database for current user without retrieving its content.
 
         :param db: Database client connection.
         :param username: Owner/user.
+        :param workflow_id: Unique workflow id.
+        """
+        workflow = await db.workflow.find_one({"id": workflow_id, "metadata.author": username}, {"_id": 1})
+        return workflow is not None
+
+    async def find_all(
+        self,
+        db: AsyncIOMotorClient,
+        username: str,
+        exclude: Optional[List[str]] = None,
+        after: Optional[Tuple[datetime, str]] = None,
+        **kwargs,
+    ):
         """
-        cursor = db.workflow.find({"metadata.author": username, **kwargs}, {"_id": 0})
-        cursor.sort([("updated_at", -1)])
+        Find workflows in database, most recently updated first.
+
+        :param db: Database client connection.
+        :param username: Owner/user.
+        :param exclude: Fields not to be retrieved from database.
+        :param after: Sort key `(updated_at, id)` of the last workflow already seen, if any.
+        """
+        query = {"metadata.author": username, **kwargs}
+        if after:
+            updated_at, workflow_id = after
+            query["$or"] = [{"updated_at": {"$lt": updated_at}}, {"updated_at": updated_at, "id": {"$lt": workflow_id}}]
+        projection = {"_id": 0, **{key: 0 for key in exclude or []}}
+        cursor = db.workflow.find(query, projection)
+        cursor.sort([("updated_at", -1), ("id", -1)])
+        cursor.batch_size(500)
         async for document in cursor:
-            yield WorkflowInDB(**document)
+            # documents were validated before being stored, skip validation
+            yield WorkflowInDB.construct(**document)
 
     async def find(
-        self, db: AsyncIOMotorClient, username: str, page_size: int, page_num: int, **kwargs
+        self,
+        db: AsyncIOMotorClient,
+        username: str,
+        page_size: int,
+        page_num: int,
+        exclude: Optional[List[str]] = None,
+        **kwargs,
     ) -> Tuple[List[WorkflowInDB], int]:
         """
         Find workflows in database.
@@ -193,18 +318,20 @@ class WorkflowManager:
         :param username: Owner/user.
         :param page_size: Number of documents to return.
         :param page_num: Page number for document's pagination.
+        :param exclude: Fields not to be retrieved from database.
         """
+        query = {"metadata.author": username, **kwargs}
+        projection = {"_id": 0, **{key: 0 for key in exclude or []}}
         # calculate number of documents to skip
         skips = page_size * (page_num - 1)
         # skip and limit
         workflows = (
-            db.workflow.find({"metadata.author": username, **kwargs}, {"_id": 0})
-            .sort([("updated_at", -1)])
-            .skip(skips)
-            .limit(page_size)
+            db.workflow.find(query, projection).sort([("updated_at", -1), ("id", -1)]).skip(skips).limit(page_size)
+        )
+        # fetch page and count total concurrently
+        workflows, count = await asyncio.gather(
+            workflows.to_list(length=page_size),
+            db.workflow.count_documents(query),
         )
-        workflows = await workflows.to_list(length=page_size)
-        # count total
-        count = db.workflow.count_documents({"metadata.author": username, **kwargs})
-        # returns model
-        return [WorkflowInDB(**workflow) for workflow in workflows], await count
+        # returns model, documents were validated before being stored
+        return [WorkflowInDB.construct(**workflow) for workflow in workflows], count
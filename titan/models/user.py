@@ -1,5 +1,5 @@
 from passlib.context import CryptContext
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, PrivateAttr, validator
 
 # security
 
@@ -9,7 +9,8 @@ class Token(BaseModel):
     token_type: str
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor is pinned explicitly: each increment doubles the time spent hashing/verifying a password
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=12)
 
 # users
 
@@ -23,6 +24,8 @@ class UserBase(BaseModel):
 class UserCreateRequest(UserBase):
     password: str
 
+    _hashed_password: str = PrivateAttr(default=None)
+
     @validator("username")
     def username_alphanumeric(cls, v):
         assert v.isalnum(), "must be alphanumeric"
@@ -35,7 +38,10 @@ class UserCreateRequest(UserBase):
 
     @property
     def hashed_password(self) -> str:
-        return pwd_context.hash(self.password)
+        # bcrypt is deliberately expensive, hash only once per request
+        if self._hashed_password is None:
+            self._hashed_password = pwd_context.hash(self.password)
+        return self._hashed_password
 
 
 class User(UserBase):
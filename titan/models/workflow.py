@@ -1,12 +1,11 @@
-import collections
+import functools
+import re
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional
 
-import rdflib
 import strconv
 from pydantic import BaseModel
-from rdflib import RDF, Graph, Literal
 
 from titan.logger import get_logger
 
@@ -25,6 +24,44 @@ class State(str, Enum):
     STATUS_DONE: str = "DONE"
 
 
+# statuses that do not change unless the workflow is executed or revoked again
+TERMINAL_STATES = (State.STATUS_DONE, State.STATUS_FAILED, State.STATUS_REVOKED)
+
+# one bit per task status, keyed by raw value as `State` members do not hash like their strings
+_STATE_BIT = {
+    State.STATUS_DONE.value: 1,
+    State.STATUS_FAILED.value: 2,
+    State.STATUS_PENDING.value: 4,
+    State.STATUS_RUNNING.value: 8,
+    State.STATUS_REVOKED.value: 16,
+}
+_UNKNOWN_BIT = 32
+
+
+def derive_status(task_statuses: List[str], is_revoked: bool = False) -> State:
+    """
+    Derives the global status of a workflow from its tasks' statuses.
+    """
+    if is_revoked:
+        return State.STATUS_REVOKED
+
+    # statuses seen are OR-ed into a mask, so each precedence check is a single bitwise test
+    mask = 0
+    for task_status in task_statuses:
+        mask |= _STATE_BIT.get(task_status, _UNKNOWN_BIT)
+
+    # no tasks at all counts as done
+    if mask in (0, _STATE_BIT[State.STATUS_DONE.value]):
+        return State.STATUS_DONE
+    if mask & _STATE_BIT[State.STATUS_FAILED.value]:
+        return State.STATUS_FAILED
+    if mask & _STATE_BIT[State.STATUS_PENDING.value]:
+        return State.STATUS_PENDING
+    if mask & _STATE_BIT[State.STATUS_RUNNING.value]:
+        return State.STATUS_RUNNING
+    return State.STATUS_UNKNOWN
+
+
 class Task(BaseModel):
     name: str
     params: dict = {}
@@ -99,10 +136,11 @@ class Operator(BaseModel):
 
 
 class Link(BaseModel):
-    fromOperator: Union[str, int]
-    fromConnector: Union[str, int]
-    toOperator: Union[str, int]
-    toConnector: Union[str, int]
+    # integer ids are coerced to strings, i.e., the same keys used for operators and connectors
+    fromOperator: str
+    fromConnector: str
+    toOperator: str
+    toConnector: str
 
     class Config:
         extra = "allow"
@@ -127,6 +165,9 @@ class WorkflowInDB(WorkflowRequest):
 
     id: str = ""
     executed: Optional[str] = None  # last execution id
+    # last execution status known to TITAN, i.e., a cache of DRAMA's: it is only written when the workflow is
+    # executed, revoked or its status is fetched, so values not in `TERMINAL_STATES` may be outdated
+    status: Optional[State] = None
 
 
 class WorkflowInDBWithStatus(WorkflowInDB):
@@ -141,11 +182,16 @@ class WorkflowInDBWithStatus(WorkflowInDB):
 # Search results
 
 
+# max. number of workflows in a single page
+MAX_PAGE_SIZE = 100
+
+
 class Pagination(BaseModel):
     page_size: int  # No of elements in page
     page_num: int  # current page
-    page_count: int  # No of pages
-    total_count: int  # No of elements in all pages
+    page_count: Optional[int]  # No of pages (unknown when paginating by cursor)
+    total_count: Optional[int]  # No of elements in all pages (unknown when paginating by cursor)
+    next_cursor: Optional[str] = None  # opaque position of the next page, if any
 
 
 class WorkflowSearchResult(BaseModel):
@@ -169,137 +215,219 @@ class WorkflowStatusSearchResult(BaseModel):
 # Parsing methods
 
 
+def _convert_param(value: Any) -> Any:
+    """
+    Converts a parameter value to its inferred type, trying the common numeric cases before `strconv`.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return strconv.convert(value)
+    except ValueError:
+        return value
+
+
 def parse_to_list(workflow) -> list:
     """
     Split a JSON-formatted workflow into a list of tasks.
     """
-    links = collections.defaultdict(dict)
-    _links = workflow["links"]
+    _operators = workflow["operators"]
 
-    for link in _links.values():
+    # index every operator output as `{(operator, connector): "operator_name.output_name"}`
+    outputs = {
+        (op_idx, out_idx): f"{op_data['properties']['name']}.{out_data['properties']['name']}"
+        for op_idx, op_data in _operators.items()
+        for out_idx, out_data in op_data["properties"]["outputs"].items()
+    }
+
+    # resolve every link target as `{(operator, connector): "operator_name.output_name"}`
+    links = {}
+
+    for link in workflow["links"].values():
         to_op_idx = link["toOperator"]
         to_con_idx = link["toConnector"]
 
         from_op_idx = link["fromOperator"]
         from_con_idx = link["fromConnector"]
 
-        logger.debug(f"found link {from_op_idx}-{from_con_idx} -> {to_op_idx}-{to_con_idx}")
+        links[(to_op_idx, to_con_idx)] = outputs.get((from_op_idx, from_con_idx))
 
-        links[to_op_idx][to_con_idx] = (from_op_idx, from_con_idx)
-
-    logger.debug(f"links {links}")
+    logger.debug("links %s", links)
 
     tasks = []
-    _operators = workflow["operators"]
 
     for op_idx, op_data in _operators.items():
-        name = op_data["properties"]["name"]
-        module = op_data["properties"]["module"]
+        op_properties = op_data["properties"]
         params = {}
 
-        for param_idx, param_data in op_data["parameters"].items():
+        for param_data in op_data["parameters"].values():
             param_properties = param_data["properties"]
             param_name = param_properties["name"]
             param_value = param_properties["value"]
 
-            try:
-                param_value = strconv.convert(param_value)
-            except ValueError:
-                pass
+            params[param_name] = _convert_param(param_value)
 
-            params[param_name] = param_value
+        inputs = {
+            in_data["properties"]["name"]: links.get((op_idx, in_idx))
+            for in_idx, in_data in op_properties["inputs"].items()
+        }
 
-        inputs = {}
+        tasks.append(
+            {"name": op_properties["name"], "module": op_properties["module"], "params": params, "inputs": inputs}
+        )
 
-        for in_idx, in_data in op_data["properties"]["inputs"].items():
-            in_properties = in_data["properties"]
-            in_name = in_properties["name"]
+    logger.debug("tasks %s", tasks)
 
-            try:
-                from_op, from_conn = links[op_idx][in_idx]
+    return tasks
 
-                from_op_name = workflow["operators"][from_op]["properties"]["name"]
-                from_op_con_name = workflow["operators"][from_op]["properties"]["outputs"][from_conn]
 
-                inputs[in_name] = f"{from_op_name}.{from_op_con_name['properties']['name']}"
-            except KeyError:
-                inputs[in_name] = None
+class NTriples:
+    """
+    RDF document made of pre-formatted N-Triples statements.
 
-        tasks.append({"name": name, "module": module, "params": params, "inputs": inputs})
+    Exposes the subset of the `rdflib.Graph` interface used throughout the platform, i.e., serialization to
+    n-triples and membership tests for `(s, p, o)` triples of rdflib terms.
+    """
 
-    logger.debug(f"tasks {tasks}")
+    def __init__(self, triples: List[str]):
+        self.triples = triples
+        self._terms = None
 
-    return tasks
+    def __len__(self) -> int:
+        return len(self.triples)
+
+    def __str__(self) -> str:
+        return "".join(self.triples)
+
+    def __contains__(self, triple) -> bool:
+        if self._terms is None:
+            # rdflib is only needed to compare against rdflib terms, avoid importing it otherwise
+            from rdflib import Graph
+
+            self._terms = frozenset(Graph().parse(data=str(self), format="nt"))
+        return triple in self._terms
+
+    def serialize(self, format: str = "nt") -> bytes:
+        if format != "nt":
+            raise ValueError(f"Unsupported serialization format '{format}'")
+        return str(self).encode("UTF-8")
 
 
-def parse_to_rdf(workflow, workflow_id: str) -> Graph:
+# characters not allowed in IRIs, which would otherwise break out of the enclosing `<...>`
+_INVALID_IRI_CHARS = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+
+
+def _iri(value: str) -> str:
     """
-    Transform a JSON-formatted workflow to RDF n-triples.
+    Formats a value as an N-Triples IRI, rejecting values that are not valid IRIs.
+    """
+    if _INVALID_IRI_CHARS.search(value):
+        raise ValueError(f"'{value}' does not look like a valid URI")
+    return f"<{value}>"
+
+
+# characters that must be escaped in N-Triples string literals
+_LITERAL_ESCAPES = str.maketrans({'"': '\\"', "\\": "\\\\", "\n": "\\n", "\r": "\\r"})
+
+
+def _lit(value: Any, datatype: Optional[str] = None) -> str:
+    """
+    Formats a value as an N-Triples literal, escaping its lexical form.
     """
-    PREFIX_TITAN = "http://www.ontologies.khaos.uma.es/titan/#"
-    PREFIX_BIGOWL = "http://www.ontologies.khaos.uma.es/bigowl#"
-    PREFIX_DMOP = "http://www.e-lico.eu/ontologies/dmo/DMOP/DMOP.owl#"
+    lexical = str(value).translate(_LITERAL_ESCAPES)
+    if datatype:
+        return f'"{lexical}"^^<{datatype}>'
+    return f'"{lexical}"'
+
+
+def _triple(s: str, p: str, o: str) -> str:
+    return f"{s} {p} {o} .\n"
+
+
+# RDF vocabulary
+
+PREFIX_TITAN = "http://www.ontologies.khaos.uma.es/titan/#"
+PREFIX_BIGOWL = "http://www.ontologies.khaos.uma.es/bigowl#"
+PREFIX_DMOP = "http://www.e-lico.eu/ontologies/dmo/DMOP/DMOP.owl#"
+PREFIX_RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+PREFIX_XSD = "http://www.w3.org/2001/XMLSchema#"
 
-    # workflow related
-    uriref_workflow = rdflib.URIRef(PREFIX_DMOP + "Workflow")
+XSD_INTEGER = PREFIX_XSD + "integer"
 
-    # task related
-    uriref_num_task = rdflib.URIRef(PREFIX_BIGOWL + "numTask")
-    uriref_has_task = rdflib.URIRef(PREFIX_BIGOWL + "hasTask")
+IRI_TYPE = _iri(PREFIX_RDF + "type")
 
-    uriref_task_has_number_outputs = rdflib.URIRef(PREFIX_BIGOWL + "numberOfOutputs")
-    uriref_task_has_number_inputs = rdflib.URIRef(PREFIX_BIGOWL + "numberOfInputs")
+# workflow related
+IRI_WORKFLOW = _iri(PREFIX_DMOP + "Workflow")
 
-    uriref_task_specifies_input_class = rdflib.URIRef(PREFIX_BIGOWL + "specifiesInputClass")
-    uriref_task_specifies_output_class = rdflib.URIRef(PREFIX_BIGOWL + "specifiesOutputClass")
+# task related
+IRI_NUM_TASK = _iri(PREFIX_BIGOWL + "numTask")
+IRI_HAS_TASK = _iri(PREFIX_BIGOWL + "hasTask")
 
-    uriref_has_task_name = rdflib.URIRef(PREFIX_BIGOWL + "hasName")
+IRI_TASK_HAS_NUMBER_OUTPUTS = _iri(PREFIX_BIGOWL + "numberOfOutputs")
+IRI_TASK_HAS_NUMBER_INPUTS = _iri(PREFIX_BIGOWL + "numberOfInputs")
 
-    # parameter related
-    uriref_has_parameter = rdflib.URIRef(PREFIX_BIGOWL + "hasParameter")
+IRI_TASK_SPECIFIES_INPUT_CLASS = _iri(PREFIX_BIGOWL + "specifiesInputClass")
+IRI_TASK_SPECIFIES_OUTPUT_CLASS = _iri(PREFIX_BIGOWL + "specifiesOutputClass")
 
-    # component related
-    uriref_has_component = rdflib.URIRef(PREFIX_BIGOWL + "hasComponent")
+IRI_HAS_TASK_NAME = _iri(PREFIX_BIGOWL + "hasName")
 
-    g = Graph()
+# component related
+IRI_HAS_COMPONENT = _iri(PREFIX_BIGOWL + "hasComponent")
 
-    name = rdflib.URIRef(PREFIX_TITAN + "Workflow" + workflow_id)
-    g.add((name, RDF.type, uriref_workflow))
-    g.add((name, uriref_num_task, Literal(len(workflow["operators"]))))
+
+@functools.lru_cache(maxsize=64)
+def _int_lit(value: int) -> str:
+    return _lit(value, XSD_INTEGER)
+
+
+def parse_to_rdf(workflow, workflow_id: str) -> NTriples:
+    """
+    Transform a JSON-formatted workflow to RDF n-triples.
+    """
+    triples = []
+
+    name = _iri(PREFIX_TITAN + "Workflow" + workflow_id)
+    triples.append(_triple(name, IRI_TYPE, IRI_WORKFLOW))
+    triples.append(_triple(name, IRI_NUM_TASK, _int_lit(len(workflow["operators"]))))
 
     for op_idx, op_data in workflow["operators"].items():
-        task = rdflib.URIRef(op_data["definition"]["uri"] + f"-{workflow_id}-{op_idx}")
-        g.add((name, uriref_has_task, task))
+        task = _iri(op_data["definition"]["uri"] + f"-{workflow_id}-{op_idx}")
+        triples.append(_triple(name, IRI_HAS_TASK, task))
 
         task_name = op_data["properties"]["name"]
-        g.add((task, uriref_has_task_name, Literal(task_name)))
+        triples.append(_triple(task, IRI_HAS_TASK_NAME, _lit(task_name)))
 
         # inputs
-        g.add(
-            (
-                task,
-                uriref_task_has_number_inputs,
-                Literal(len(op_data["properties"]["inputs"])),
-            )
-        )
-        for _, op_input in op_data["properties"]["inputs"].items():
-            input_task = rdflib.URIRef(op_input["definition"]["uri"])
-            g.add((task, uriref_task_specifies_input_class, input_task))
+        op_inputs = op_data["properties"]["inputs"]
+        triples.append(_triple(task, IRI_TASK_HAS_NUMBER_INPUTS, _int_lit(len(op_inputs))))
+        for _, op_input in op_inputs.items():
+            input_task = _iri(op_input["definition"]["uri"])
+            triples.append(_triple(task, IRI_TASK_SPECIFIES_INPUT_CLASS, input_task))
 
         # outputs
-        g.add(
-            (
-                task,
-                uriref_task_has_number_outputs,
-                Literal(len(op_data["properties"]["outputs"])),
-            )
-        )
-        for _, op_output in op_data["properties"]["outputs"].items():
-            output_task = rdflib.URIRef(op_output["definition"]["uri"])
-            g.add((task, uriref_task_specifies_output_class, output_task))
+        op_outputs = op_data["properties"]["outputs"]
+        triples.append(_triple(task, IRI_TASK_HAS_NUMBER_OUTPUTS, _int_lit(len(op_outputs))))
+        for _, op_output in op_outputs.items():
+            output_task = _iri(op_output["definition"]["uri"])
+            triples.append(_triple(task, IRI_TASK_SPECIFIES_OUTPUT_CLASS, output_task))
 
         # component
-        component = rdflib.URIRef(op_data["definition"]["uri"])
-        g.add((task, uriref_has_component, component))
+        component = _iri(op_data["definition"]["uri"])
+        triples.append(_triple(task, IRI_HAS_COMPONENT, component))
+
+    return NTriples(triples)
 
-    return g
+
+def parse_to_rdf_nt(workflow, workflow_id: str) -> str:
+    """
+    Transform a JSON-formatted workflow to a string of RDF n-triples, e.g., to be embedded in a SPARQL update.
+    """
+    return str(parse_to_rdf(workflow, workflow_id=workflow_id))
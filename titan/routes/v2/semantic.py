@@ -1,3 +1,5 @@
+import asyncio
+import functools
 from typing import List
 
 from fastapi import APIRouter, Depends
@@ -11,7 +13,20 @@ from titan.semantic.bigowl import BIGOWL
 from titan.semantic.repository import Virtuoso
 
 router = APIRouter()
-ontology = BIGOWL(Virtuoso(**settings.rdf_connection_settings))
+
+
+@functools.lru_cache(maxsize=None)
+def get_ontology() -> BIGOWL:
+    """
+    Returns the ontology client, created on first use rather than at import time.
+    """
+    return BIGOWL(Virtuoso(**settings.rdf_connection_settings))
+
+
+async def close_ontology_connection():
+    # nothing to close if the ontology was never used
+    if get_ontology.cache_info().currsize:
+        await get_ontology().db.aclose()
 
 
 @router.get("/component/get/all", name="List components from repository", tags=["semantic"])
@@ -19,45 +34,43 @@ async def all_components(include_parameters: bool = True, include_connections: b
     """
     List all components from the repository with optional information about their connection and parameters.
     """
-    return {
-        **await ontology.components(
-            "DataCollection", include_parameters=include_parameters, include_connections=include_connections
-        ),
-        **await ontology.components(
-            "DataProcessing", include_parameters=include_parameters, include_connections=include_connections
-        ),
-        **await ontology.components(
-            "DataAnalysing", include_parameters=include_parameters, include_connections=include_connections
-        ),
-        **await ontology.components(
-            "DataSink", include_parameters=include_parameters, include_connections=include_connections
-        ),
-    }
+    ontology = get_ontology()
+
+    # component types are independent, query them concurrently (each is cached by `BIGOWL.components`)
+    results = await asyncio.gather(
+        *(
+            ontology.components(
+                component_type, include_parameters=include_parameters, include_connections=include_connections
+            )
+            for component_type in ("DataCollection", "DataProcessing", "DataAnalysing", "DataSink")
+        )
+    )
+    return {k: v for result in results for k, v in result.items()}
 
 
 @router.get("/component/parameters", name="Get component parameters", tags=["semantic"])
 async def parameters(component_id: str, uri: str) -> list:
-    return await ontology.parameters(uri=f"{uri}#{component_id}")
+    return await get_ontology().parameters(uri=f"{uri}#{component_id}")
 
 
 @router.get("/component/compatible", name="Get compatible components", tags=["semantic"])
 async def compatible(component_id: str, uri: str) -> dict:
-    return await ontology.compatible(uri=f"{uri}#{component_id}")
+    return await get_ontology().compatible(uri=f"{uri}#{component_id}")
 
 
 @router.get("/component/connection/inputs", name="Get input classes for given component", tags=["semantic"])
 async def input_classes(component_id: str, uri: str) -> list:
-    return await ontology.inputs(uri=f"{uri}#{component_id}")
+    return await get_ontology().inputs(uri=f"{uri}#{component_id}")
 
 
 @router.get("/component/connection/outputs", name="Get output classes for given component", tags=["semantic"])
 async def output_classes(component_id: str, uri: str) -> list:
-    return await ontology.outputs(uri=f"{uri}#{component_id}")
+    return await get_ontology().outputs(uri=f"{uri}#{component_id}")
 
 
 @router.get("/component/connection/parents", name="Get parent classes for given connection", tags=["semantic"])
 async def parent_classes(connection_id: str, uri: str) -> List[str]:
-    return await ontology.parents(uri=f"{uri}#{connection_id}")
+    return await get_ontology().parents(uri=f"{uri}#{connection_id}")
 
 
 @router.get(
@@ -66,7 +79,7 @@ async def parent_classes(connection_id: str, uri: str) -> List[str]:
     tags=["semantic"],
 )
 async def invalid_components(workflow_id: str = None, uri: str = None) -> list:
-    invalid = await ontology.check_invalid_components(uri=f"{uri}#{workflow_id}")
+    invalid = await get_ontology().check_invalid_components(uri=f"{uri}#{workflow_id}")
     return invalid
 
 
@@ -79,5 +92,5 @@ async def submit_mapping(
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorClient = Depends(get_connection),
 ):
-    # = await ontology.db.insert()
+    # = await get_ontology().db.insert()
     pass
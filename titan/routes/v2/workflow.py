@@ -1,6 +1,9 @@
-from typing import Callable
+import math
+from collections import Counter
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from titan.auth import get_current_active_user
@@ -9,7 +12,9 @@ from titan.logger import get_logger
 from titan.manager import WorkflowManager
 from titan.models.user import UserInDB
 from titan.models.workflow import (
+    MAX_PAGE_SIZE,
     State,
+    Task,
     WorkflowInDB,
     WorkflowInDBWithStatus,
     WorkflowRequest,
@@ -19,6 +24,7 @@ from titan.models.workflow import (
 logger = get_logger(__name__)
 
 router = APIRouter()
+workflow_manager = WorkflowManager()
 
 
 @router.post(
@@ -32,7 +38,7 @@ async def new(
     """
     Creates empty workflow in database.
     """
-    workflow = await WorkflowManager().insert(db, username=current_user.username, workflow=workflow)
+    workflow = await workflow_manager.insert(db, username=current_user.username, workflow=workflow)
     return workflow
 
 
@@ -55,11 +61,11 @@ async def update(
     """
     Updates existing workflow in database.
     """
-    exists = await WorkflowManager().find_one(db, username=current_user.username, workflow_id=workflow_id)
+    exists = await workflow_manager.exists(db, username=current_user.username, workflow_id=workflow_id)
     if not exists:
         raise HTTPException(status_code=404, detail=f"Workflow {workflow_id} not found")
 
-    workflow = await WorkflowManager().upsert(
+    workflow = await workflow_manager.upsert(
         db, username=current_user.username, workflow_id=workflow_id, workflow=workflow
     )
 
@@ -84,7 +90,7 @@ async def get(
     """
     Retrieves data from workflow in database.
     """
-    workflow = await WorkflowManager().find_one(db, username=current_user.username, workflow_id=workflow_id)
+    workflow = await workflow_manager.find_one(db, username=current_user.username, workflow_id=workflow_id)
     if not workflow:
         raise HTTPException(status_code=404, detail=f"Workflow {workflow_id} not found")
     return workflow
@@ -94,7 +100,7 @@ async def get(
     "/get/all", name="List user's workflows", tags=["workflow"], response_model=WorkflowSearchResult, status_code=200
 )
 async def get_all(
-    page_size: int = Query(default=10, ge=1),
+    page_size: int = Query(default=10, ge=1, le=MAX_PAGE_SIZE),
     page_num: int = Query(default=1, ge=1),
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncIOMotorClient = Depends(get_connection),
@@ -102,21 +108,49 @@ async def get_all(
     """
     Lists all workflows from current user.
     """
-    workflows, total_count = await WorkflowManager().find(
+    workflows, total_count = await workflow_manager.find(
         db, username=current_user.username, page_size=page_size, page_num=page_num
     )
 
-    return WorkflowSearchResult(
-        workflows=workflows,
-        pagination={
-            "page_size": page_size,
-            "page_num": page_num,
-            "page_count": round(total_count / page_size),
-            "total_count": total_count,
-        },
+    # documents are already validated models, serialize them directly instead of
+    # letting `response_model` validate every workflow a second time
+    return ORJSONResponse(
+        {
+            "workflows": [workflow.dict() for workflow in workflows],
+            "pagination": {
+                "page_size": page_size,
+                "page_num": page_num,
+                "page_count": math.ceil(total_count / page_size),
+                "total_count": total_count,
+            },
+        }
     )
 
 
+@router.get(
+    "/get/all/stream",
+    name="Stream user's workflows",
+    tags=["workflow"],
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    status_code=200,
+)
+async def get_all_stream(
+    current_user: UserInDB = Depends(get_current_active_user),
+    db: AsyncIOMotorClient = Depends(get_connection),
+) -> StreamingResponse:
+    """
+    Streams all workflows from current user as newline-delimited JSON, most recently updated first.
+    """
+    workflows = workflow_manager.find_all(db, username=current_user.username)
+
+    async def _serialize():
+        async for workflow in workflows:
+            yield orjson.dumps(workflow.dict()) + b"\n"
+
+    return StreamingResponse(_serialize(), media_type="application/x-ndjson")
+
+
 @router.post(
     "/run",
     name="Run workflow",
@@ -137,19 +171,17 @@ async def run(
     Executes workflow from database.
     """
     # get workflow from db
-    workflow = await WorkflowManager().find_one(db, username=current_user.username, workflow_id=workflow_id)
+    workflow = await workflow_manager.find_one(db, username=current_user.username, workflow_id=workflow_id)
     if not workflow:
         raise HTTPException(status_code=404, detail=f"Workflow '{workflow_id}' not found")
 
     # execute
     try:
-        await WorkflowManager().execute(db, workflow=workflow)
+        await workflow_manager.execute(db, workflow=workflow)
     except KeyError as err:
         logger.debug(f"There was an error executing the workflow '{workflow_id}'")
         raise HTTPException(status_code=500, detail=f"Missing key '{err.args[0]}'")
 
-    workflow = await WorkflowManager().find_one(db, username=current_user.username, workflow_id=workflow_id)
-
     return workflow
 
 
@@ -172,7 +204,7 @@ async def revoke(
     Revoke workflow execution.
     """
     # get workflow from db
-    workflow = await WorkflowManager().find_one(db, username=current_user.username, workflow_id=workflow_id)
+    workflow = await workflow_manager.find_one(db, username=current_user.username, workflow_id=workflow_id)
     if not workflow:
         raise HTTPException(status_code=404, detail=f"Workflow {workflow_id} not found")
 
@@ -180,7 +212,7 @@ async def revoke(
     if not workflow.executed:
         raise HTTPException(status_code=404, detail=f"Workflow has not been executed yet")
 
-    await WorkflowManager().revoke(workflow)
+    await workflow_manager.revoke(db, workflow)
 
 
 @router.get(
@@ -204,7 +236,7 @@ async def status(
     Checks execution status from workflow in database.
     """
     # get workflow from db
-    workflow = await WorkflowManager().find_one(db, username=current_user.username, workflow_id=workflow_id)
+    workflow = await workflow_manager.find_one(db, username=current_user.username, workflow_id=workflow_id)
     if not workflow:
         raise HTTPException(status_code=404, detail=f"Workflow {workflow_id} not found")
 
@@ -212,44 +244,48 @@ async def status(
     if not workflow.executed:
         raise HTTPException(status_code=404, detail=f"Workflow has not been executed yet")
 
-    response, status_code = await WorkflowManager().status(workflow)
+    response, status_code = await workflow_manager.status(workflow)
     if status_code != 200:
         raise HTTPException(status_code=500, detail="Could not retrieve workflow status")
 
     # read tasks
+    # tasks and their status counts are collected in a single pass
     tasks_with_status = []
-    tasks_status_only = []
+    counts = Counter()
 
     for task in response["tasks"]:
         _status = task.get("status").upper()  # compatibility with older DRAMA versions
+        counts[_status] += 1
         tasks_with_status.append(
-            {
-                "name": task.get("name"),
-                "params": task.get("params"),
-                "inputs": task.get("inputs"),
-                "created_at": task.get("created_at"),
-                "updated_at": task.get("updated_at"),
-                "result": task.get("result"),
-                "status": _status,
-            }
+            Task.construct(
+                name=task.get("name"),
+                params=task.get("params"),
+                inputs=task.get("inputs"),
+                created_at=task.get("created_at"),
+                updated_at=task.get("updated_at"),
+                result=task.get("result"),
+                status=_status,
+            )
         )
-        tasks_status_only.append(_status)
 
     # append global status based on task statuses
-    def _check(comp: Callable, stats: list) -> bool:
-        return comp([s in stats for s in tasks_status_only])
+    # (counted by raw value, as `State` members do not hash like their strings)
+    total = len(tasks_with_status)
 
-    if _check(all, [State.STATUS_DONE]):
+    if counts[State.STATUS_DONE.value] == total:
         workflow_status = State.STATUS_DONE
-    elif _check(all, [State.STATUS_PENDING]):
+    elif counts[State.STATUS_PENDING.value] == total:
         workflow_status = State.STATUS_PENDING
-    elif _check(all, [State.STATUS_PENDING, State.STATUS_RUNNING]):
+    elif counts[State.STATUS_PENDING.value] + counts[State.STATUS_RUNNING.value] == total:
         workflow_status = State.STATUS_RUNNING
-    elif _check(any, [State.STATUS_FAILED]):
+    elif counts[State.STATUS_FAILED.value]:
         workflow_status = State.STATUS_FAILED
     else:
         workflow_status = State.STATUS_UNKNOWN
 
-    workflow_with_status = WorkflowInDBWithStatus(**workflow.dict(), tasks=tasks_with_status, status=workflow_status)
+    # workflow comes from the database and tasks from DRAMA, skip re-validating them
+    workflow_with_status = WorkflowInDBWithStatus.construct(
+        **{**workflow.__dict__, "tasks": tasks_with_status, "status": workflow_status}
+    )
 
     return workflow_with_status
@@ -1,17 +1,24 @@
+import asyncio
+import base64
 import math
-import traceback
-from typing import Callable, Optional
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Optional, Tuple, Union
 
+import orjson
+from bson import json_util
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from starlette.requests import Request
-from starlette.status import HTTP_404_NOT_FOUND
+from starlette.status import HTTP_404_NOT_FOUND, HTTP_422_UNPROCESSABLE_ENTITY
 
-from titan.auth import get_user_by_username
+from titan.auth import get_cached_user_by_username, get_user_by_username
 from titan.database import get_connection
 from titan.logger import get_logger
 from titan.manager import WorkflowManager
 from titan.models.workflow import (
+    MAX_PAGE_SIZE,
+    TERMINAL_STATES,
     State,
     Task,
     WorkflowInDB,
@@ -19,11 +26,16 @@ from titan.models.workflow import (
     WorkflowRequest,
     WorkflowSearchResult,
     WorkflowStatusSearchResult,
+    derive_status,
 )
 
 logger = get_logger(__name__)
 
 router = APIRouter()
+workflow_manager = WorkflowManager()
+
+# max. number of workflow statuses requested to DRAMA at once
+MAX_CONCURRENT_STATUS_REQUESTS = 16
 
 
 @router.post(
@@ -48,7 +60,7 @@ async def new(
     if not user_by_username:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
 
-    workflow = await WorkflowManager().insert(db, username=username, workflow=workflow)
+    workflow = await workflow_manager.insert(db, username=username, workflow=workflow)
 
     return workflow
 
@@ -73,23 +85,171 @@ async def update(
     """
     Updates existing workflow in database.
     """
-    user_by_username = await get_user_by_username(db, username)
+    # both lookups are independent
+    user_by_username, exists = await asyncio.gather(
+        get_user_by_username(db, username),
+        workflow_manager.exists(db, username=username, workflow_id=workflow_id),
+    )
     if not user_by_username:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
 
-    exists = await WorkflowManager().find_one(db, username=username, workflow_id=workflow_id)
     if not exists:
         raise HTTPException(status_code=404, detail=f"Workflow {workflow_id} not found")
 
-    workflow = await WorkflowManager().upsert(db, username=username, workflow_id=workflow_id, workflow=workflow)
+    workflow = await workflow_manager.upsert(db, username=username, workflow_id=workflow_id, workflow=workflow)
 
     return workflow
 
 
-def _exclude_keys(dictionary, keys: list):
+# query parameters of each endpoint that are not used for filtering
+_GET_PARAMS = frozenset(["username", "workflow_id", "page_size", "page_num"])
+_STATUS_PARAMS = _GET_PARAMS | {"exclude_key"}
+_FSTATUS_PARAMS = frozenset(["username", "page_size", "page_num", "exclude_key", "with_status", "cursor"])
+
+
+def _exclude_keys(dictionary, keys: Iterable[str]) -> dict:
     """Filters a dict by excluding certain keys."""
-    key_set = set(dictionary.keys()) - set(keys)
-    return {key: dictionary[key] for key in key_set}
+    if not isinstance(keys, (set, frozenset)):
+        keys = frozenset(keys)
+    return {key: value for key, value in dictionary.items() if key not in keys}
+
+
+# dates are decoded as timezone-aware, as read from database
+_CURSOR_JSON = json_util.JSONOptions(tz_aware=True, tzinfo=timezone.utc)
+
+
+def _encode_cursor(workflow: WorkflowInDB) -> str:
+    """Encodes the sort key of a workflow as an opaque pagination cursor."""
+    return base64.urlsafe_b64encode(json_util.dumps([workflow.updated_at, workflow.id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[Union[datetime, str], str]:
+    """Decodes a pagination cursor back into a `(updated_at, id)` sort key, rejecting malformed ones."""
+    try:
+        updated_at, workflow_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()), json_options=_CURSOR_JSON)
+    except Exception:
+        raise ValueError(f"Invalid cursor {cursor}")
+    # dates of workflows stored before they were saved as such are still strings
+    if not isinstance(updated_at, (datetime, str)) or not isinstance(workflow_id, str):
+        raise ValueError(f"Invalid cursor {cursor}")
+    return updated_at, workflow_id
+
+
+def _excluded_fields(exclude_key: list) -> frozenset:
+    """Fields left out of workflows with status, computed once per request."""
+    # stored status is replaced by the one derived from DRAMA
+    return frozenset(exclude_key) | {"status"}
+
+
+# fields always read from database, as statuses, stored status updates and cursors depend on them
+_PROTECTED_FIELDS = frozenset(["id", "executed", "status", "updated_at"])
+
+
+def _projected_out(exclude_key: list) -> List[str]:
+    """Fields left out when reading workflows from database, rejecting keys that are not (nested) workflow fields."""
+    paths = {key: key.split(".") for key in exclude_key}
+    invalid = [key for key, path in paths.items() if path[0] not in WorkflowInDBWithStatus.__fields__ or not all(path)]
+    if invalid:
+        raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid keys to exclude: {invalid}")
+    # fields nested in excluded ones go with them, as the database rejects projections including both
+    return [
+        key
+        for key, path in paths.items()
+        if path[0] not in _PROTECTED_FIELDS and not any(".".join(path[:i]) in paths for i in range(1, len(path)))
+    ]
+
+
+async def _with_status(db: AsyncIOMotorClient, workflow: WorkflowInDB, excluded: frozenset) -> WorkflowInDBWithStatus:
+    """Fetches tasks' statuses of workflow from DRAMA and derives its global status."""
+    # workflow comes from the database, copy its fields as they are instead of re-validating them
+    workflow_as_dict = {key: value for key, value in workflow.__dict__.items() if key not in excluded}
+
+    workflow_with_status = WorkflowInDBWithStatus.construct(**workflow_as_dict, tasks=None, status=State.STATUS_UNKNOWN)
+
+    # workflows not executed yet have no status to fetch
+    if not workflow.executed:
+        return workflow_with_status
+
+    # terminal statuses do not change, DRAMA is only needed for the tasks
+    if "tasks" in excluded and workflow.status in TERMINAL_STATES:
+        return WorkflowInDBWithStatus.construct(**workflow_as_dict, tasks=None, status=State(workflow.status))
+
+    # get tasks statuses from workflow
+    # and derive global status
+    try:
+        # fetch tasks' statuses
+        response, status_code = await workflow_manager.status(workflow)
+        assert status_code, "Could not establish connection with database"
+        assert status_code == 200, "Status request failed"
+
+        # derive global status based on task statuses
+        # (upper-cased for compatibility with older DRAMA versions)
+        tasks_statuses_only = [task.get("status").upper() for task in response["tasks"]]
+        workflow_status = derive_status(tasks_statuses_only, is_revoked=response.get("is_revoked"))
+
+        # read tasks, unless excluded from response
+        tasks_with_status = None
+        if "tasks" not in excluded:
+            tasks_with_status = [
+                Task.construct(**{**task, "status": State(status)})
+                for task, status in zip(response["tasks"], tasks_statuses_only)
+            ]
+
+        if workflow.status != workflow_status:
+            await workflow_manager.save_status(db, workflow, workflow_status)
+
+        workflow_with_status = WorkflowInDBWithStatus.construct(
+            **workflow_as_dict, tasks=tasks_with_status, status=workflow_status
+        )
+    except Exception:
+        logger.exception("Failed to derive status for workflow %s", workflow.id)
+
+    return workflow_with_status
+
+
+async def _fetch_statuses(
+    db: AsyncIOMotorClient, workflows: List[WorkflowInDB], excluded: frozenset
+) -> List[WorkflowInDBWithStatus]:
+    """Fetches statuses of several workflows concurrently, keeping their order."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_STATUS_REQUESTS)
+
+    async def _bounded(workflow: WorkflowInDB) -> WorkflowInDBWithStatus:
+        async with semaphore:
+            return await _with_status(db, workflow, excluded)
+
+    return list(await asyncio.gather(*(_bounded(workflow) for workflow in workflows)))
+
+
+async def _iter_with_status(
+    db: AsyncIOMotorClient,
+    workflows: AsyncIterator[WorkflowInDB],
+    excluded: frozenset,
+    batch_size: int = MAX_CONCURRENT_STATUS_REQUESTS,
+) -> AsyncIterator[Tuple[WorkflowInDB, WorkflowInDBWithStatus]]:
+    """Yields workflows along with their status, fetching statuses of a batch of workflows at a time."""
+    batch = []
+    async for workflow in workflows:
+        batch.append(workflow)
+        if len(batch) == batch_size:
+            for item in zip(batch, await _fetch_statuses(db, batch, excluded)):
+                yield item
+            batch = []
+    if batch:
+        for item in zip(batch, await _fetch_statuses(db, batch, excluded)):
+            yield item
+
+
+def _status_candidates(with_status: State) -> dict:
+    """Query on the stored status matching every workflow that may have the requested one."""
+    # a stored status may be outdated unless terminal, such workflows must be refreshed to be told apart
+    alternatives = [
+        {"status": with_status.value},
+        {"executed": {"$ne": None}, "status": {"$nin": [state.value for state in TERMINAL_STATES]}},
+    ]
+    # workflows never executed have no status at all
+    if with_status == State.STATUS_UNKNOWN:
+        alternatives.append({"executed": None})
+    return {"$or": alternatives}
 
 
 @router.get(
@@ -105,7 +265,7 @@ async def get(
     request: Request,
     username: str,
     workflow_id: Optional[str] = None,
-    page_size: int = Query(default=1, ge=1),
+    page_size: int = Query(default=1, ge=1, le=MAX_PAGE_SIZE),
     page_num: int = Query(default=1, ge=1),
     db: AsyncIOMotorClient = Depends(get_connection),
 ) -> WorkflowSearchResult:
@@ -116,19 +276,19 @@ async def get(
 
     ```?username=test&page_size=1&page_num=1&metadata.key=value&metadata.key2=value2```
     """
-    user_by_username = await get_user_by_username(db, username)
+    user_by_username = await get_cached_user_by_username(db, username)
     if not user_by_username:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
 
     if workflow_id:
-        workflows, total_count = await WorkflowManager().find(
+        workflows, total_count = await workflow_manager.find(
             db, username=username, id=workflow_id, page_size=page_size, page_num=page_num
         )
     else:
         query_params = request.query_params
-        filtering = _exclude_keys(query_params, ["username", "workflow_id", "page_size", "page_num"])
+        filtering = _exclude_keys(query_params, _GET_PARAMS)
 
-        workflows, total_count = await WorkflowManager().find(
+        workflows, total_count = await workflow_manager.find(
             db, username=username, page_size=page_size, page_num=page_num, **filtering
         )
 
@@ -159,7 +319,7 @@ async def status(
     request: Request,
     username: str,
     workflow_id: Optional[str] = None,
-    page_size: int = Query(default=1, ge=1),
+    page_size: int = Query(default=1, ge=1, le=MAX_PAGE_SIZE),
     page_num: int = Query(default=1, ge=1),
     exclude_key: list = Query(default=["operators", "links"]),
     db: AsyncIOMotorClient = Depends(get_connection),
@@ -171,79 +331,29 @@ async def status(
 
     ```?username=test&page_size=1&page_num=1&metadata.key=value&metadata.key2=value2```
     """
-    user_by_username = await get_user_by_username(db, username)
+    projected_out = _projected_out(exclude_key)
+
+    user_by_username = await get_cached_user_by_username(db, username)
     if not user_by_username:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
 
     if workflow_id:
-        workflows, total_count = await WorkflowManager().find(
-            db, username=username, id=workflow_id, page_size=page_size, page_num=page_num
+        workflows, total_count = await workflow_manager.find(
+            db, username=username, id=workflow_id, page_size=page_size, page_num=page_num, exclude=projected_out
         )
     else:
         query_params = request.query_params
-        filtering = _exclude_keys(query_params, ["username", "workflow_id", "page_size", "page_num", "exclude_key"])
+        filtering = _exclude_keys(query_params, _STATUS_PARAMS)
 
-        workflows, total_count = await WorkflowManager().find(
-            db, username=username, page_size=page_size, page_num=page_num, **filtering
+        workflows, total_count = await workflow_manager.find(
+            db, username=username, page_size=page_size, page_num=page_num, exclude=projected_out, **filtering
         )
 
     if not workflows:
         raise HTTPException(status_code=404, detail="No results matching query were found")
 
-    workflows_with_status = []
-
-    for workflow in workflows:
-        workflow_as_dict = workflow.dict(exclude=set(exclude_key))
-
-        workflow_with_status = WorkflowInDBWithStatus(**workflow_as_dict, tasks=None, status=State.STATUS_UNKNOWN)
-
-        # get tasks statuses from workflow
-        # and derive global status
-        try:
-            assert workflow.executed, "Workflow has not been executed yet"
-
-            # fetch tasks' statuses
-            response, status_code = await WorkflowManager().status(workflow)
-            assert status_code, "Could not establish connection with database"
-            assert status_code == 200, "Status request failed"
-
-            # read tasks
-            tasks_with_status = []
-            tasks_statuses_only = []
-
-            for task in response["tasks"]:
-                tasks_with_status.append(Task(**task))
-
-                task_status = task.get("status").upper()  # compatibility with older DRAMA versions
-                tasks_statuses_only.append(task_status)
-
-            # append global status based on task statuses
-            def _check(comp: Callable, stats: list) -> bool:
-                return comp([s in stats for s in tasks_statuses_only])
-
-            # check global status
-            if response.get("is_revoked"):
-                workflow_status = State.STATUS_REVOKED
-            elif _check(all, [State.STATUS_DONE]):
-                workflow_status = State.STATUS_DONE
-            elif _check(any, [State.STATUS_FAILED]):
-                workflow_status = State.STATUS_FAILED
-            elif _check(all, [State.STATUS_PENDING]):
-                workflow_status = State.STATUS_PENDING
-            elif _check(any, [State.STATUS_PENDING]) and not _check(any, [State.STATUS_FAILED]):
-                workflow_status = State.STATUS_PENDING
-            elif _check(any, [State.STATUS_RUNNING]) and not _check(any, [State.STATUS_FAILED]):
-                workflow_status = State.STATUS_RUNNING
-            else:
-                workflow_status = State.STATUS_UNKNOWN
-
-            workflow_with_status = WorkflowInDBWithStatus(
-                **workflow_as_dict, tasks=tasks_with_status, status=workflow_status
-            )
-        except Exception:
-            logger.error(traceback.format_exc())
-
-        workflows_with_status.append(workflow_with_status)
+    # fetch statuses concurrently
+    workflows_with_status = await _fetch_statuses(db, workflows, _excluded_fields(exclude_key))
 
     return WorkflowStatusSearchResult(
         workflows=workflows_with_status,
@@ -268,100 +378,120 @@ async def status(
 async def status(
     request: Request,
     username: str,
-    page_size: int = Query(default=1, ge=1),
+    page_size: int = Query(default=1, ge=1, le=MAX_PAGE_SIZE),
     page_num: int = Query(default=1, ge=1),
     exclude_key: list = Query(default=["operators", "links"]),
     with_status: State = State.STATUS_DONE,
+    cursor: Optional[str] = None,
     db: AsyncIOMotorClient = Depends(get_connection),
 ) -> WorkflowStatusSearchResult:
-    user_by_username = await get_user_by_username(db, username)
-    if not user_by_username:
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
+    """
+    Retrieves workflows from database with the given execution status.
 
-    query_params = request.query_params
-    filtering = _exclude_keys(query_params, ["username", "page_size", "page_num", "exclude_key", "with_status"])
+    Workflows are matched on their current status. Stored statuses that may be outdated, i.e., missing or not final,
+    are refreshed from DRAMA first, so pages are filled only with workflows that actually match.
 
-    workflows = WorkflowManager().find_all(db, username=username, **filtering)
+    Pages can be requested either by number or, more efficiently, by passing the `next_cursor` from a previous page
+    as `cursor`. Page and total counts are only known once the last page is reached by number.
+    """
+    after = None
+    if cursor:
+        try:
+            after = _decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    current_count, total_count = 0, 0
-    skips = page_size * (page_num - 1)
+    projected_out = _projected_out(exclude_key)
 
-    workflows_with_status = []
+    user_by_username = await get_cached_user_by_username(db, username)
+    if not user_by_username:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
 
-    async for workflow in workflows:
-        workflow_as_dict = workflow.dict(exclude=set(exclude_key))
+    query_params = request.query_params
+    filtering = _exclude_keys(query_params, _FSTATUS_PARAMS)
 
-        workflow_with_status = WorkflowInDBWithStatus(**workflow_as_dict, tasks=None, status=State.STATUS_UNKNOWN)
+    # the database narrows down workflows to those that may match, their current status tells which do
+    filtering = {**filtering, "$and": [_status_candidates(with_status)]}
+    workflows = workflow_manager.find_all(db, username=username, exclude=projected_out, after=after, **filtering)
 
-        # get tasks statuses from workflow
-        # and derive global status
-        try:
-            assert workflow.executed, "Workflow has not been executed yet"
-
-            # fetch tasks' statuses
-            response, status_code = await WorkflowManager().status(workflow)
-            assert status_code, "Could not establish connection with database"
-            assert status_code == 200, "Status request failed"
-
-            # read tasks
-            tasks_with_status = []
-            tasks_statuses_only = []
-
-            for task in response["tasks"]:
-                tasks_with_status.append(Task(**task))
-
-                task_status = task.get("status").upper()  # compatibility with older DRAMA versions
-                tasks_statuses_only.append(task_status)
-
-            # append global status based on task statuses
-            def _check(comp: Callable, stats: list) -> bool:
-                return comp([s in stats for s in tasks_statuses_only])
-
-            # check global status
-            if response.get("is_revoked"):
-                workflow_status = State.STATUS_REVOKED
-            elif _check(all, [State.STATUS_DONE]):
-                workflow_status = State.STATUS_DONE
-            elif _check(any, [State.STATUS_FAILED]):
-                workflow_status = State.STATUS_FAILED
-            elif _check(all, [State.STATUS_PENDING]):
-                workflow_status = State.STATUS_PENDING
-            elif _check(any, [State.STATUS_PENDING]) and not _check(any, [State.STATUS_FAILED]):
-                workflow_status = State.STATUS_PENDING
-            elif _check(any, [State.STATUS_RUNNING]) and not _check(any, [State.STATUS_FAILED]):
-                workflow_status = State.STATUS_RUNNING
-            else:
-                workflow_status = State.STATUS_UNKNOWN
-
-            workflow_with_status = WorkflowInDBWithStatus(
-                **workflow_as_dict, tasks=tasks_with_status, status=workflow_status
-            )
-        except Exception:
-            logger.error(traceback.format_exc())
-
-        if workflow_with_status.status == with_status:
-            if total_count >= skips and len(workflows_with_status) < page_size:
-                current_count += 1
-                workflows_with_status.append(workflow_with_status)
-            total_count += 1
-
-        # if page_size <= len(workflows_with_status):
-        #    break
+    # matches are counted to skip previous pages, and one past the page tells whether there are more
+    skips = 0 if after else page_size * (page_num - 1)
+    matches = 0
+    workflows_with_status = []
+    last_workflow, next_cursor = None, None
+    async for workflow, workflow_with_status in _iter_with_status(
+        db, workflows, _excluded_fields(exclude_key), batch_size=min(page_size + 1, MAX_CONCURRENT_STATUS_REQUESTS)
+    ):
+        if workflow_with_status.status != with_status:
+            continue
+        matches += 1
+        if matches <= skips:
+            continue
+        if len(workflows_with_status) == page_size:
+            next_cursor = _encode_cursor(last_workflow)
+            break
+        workflows_with_status.append(workflow_with_status)
+        last_workflow = workflow
 
     if not workflows_with_status:
         raise HTTPException(status_code=404, detail="No results matching query were found")
 
+    # every match has been seen only if the last page was reached by number
+    total_count = matches if not after and not next_cursor else None
+
     return WorkflowStatusSearchResult(
         workflows=workflows_with_status,
         pagination={
             "page_size": len(workflows_with_status),
             "page_num": page_num,
-            "page_count": math.ceil(total_count / page_size),
+            "page_count": math.ceil(total_count / page_size) if total_count is not None else None,
             "total_count": total_count,
+            "next_cursor": next_cursor,
         },
     )
 
 
+@router.get(
+    "/fstatus/stream",
+    summary="Streams workflow(s) with given execution state",
+    tags=["workflow", "dev"],
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    response_description="Newline-delimited JSON workflows",
+    status_code=200,
+)
+async def fstatus_stream(
+    request: Request,
+    username: str,
+    exclude_key: list = Query(default=["operators", "links"]),
+    with_status: State = State.STATUS_DONE,
+    db: AsyncIOMotorClient = Depends(get_connection),
+) -> StreamingResponse:
+    """
+    Streams every workflow from database with the given execution status as newline-delimited JSON, most recently
+    updated first. Workflows are sent as soon as their status is known, instead of in pages, and matched as in
+    `/fstatus`.
+    """
+    projected_out = _projected_out(exclude_key)
+
+    user_by_username = await get_cached_user_by_username(db, username)
+    if not user_by_username:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
+
+    query_params = request.query_params
+    filtering = _exclude_keys(query_params, _FSTATUS_PARAMS)
+
+    filtering = {**filtering, "$and": [_status_candidates(with_status)]}
+    workflows = workflow_manager.find_all(db, username=username, exclude=projected_out, **filtering)
+
+    async def _serialize():
+        async for _, workflow_with_status in _iter_with_status(db, workflows, _excluded_fields(exclude_key)):
+            if workflow_with_status.status == with_status:
+                yield orjson.dumps(workflow_with_status.dict()) + b"\n"
+
+    return StreamingResponse(_serialize(), media_type="application/x-ndjson")
+
+
 @router.post(
     "/run",
     summary="Executes workflow",
@@ -382,24 +512,24 @@ async def run(
     """
     Executes workflow from database.
     """
-    user_by_username = await get_user_by_username(db, username)
+    # get user and workflow from db, both lookups are independent
+    user_by_username, workflow = await asyncio.gather(
+        get_user_by_username(db, username),
+        workflow_manager.find_one(db, username=username, workflow_id=workflow_id),
+    )
     if not user_by_username:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
 
-    # get workflow from db
-    workflow = await WorkflowManager().find_one(db, username=username, workflow_id=workflow_id)
     if not workflow:
         raise HTTPException(status_code=404, detail=f"Workflow '{workflow_id}' not found")
 
     # execute
     try:
-        await WorkflowManager().execute(db, workflow=workflow)
+        await workflow_manager.execute(db, workflow=workflow)
     except KeyError as err:
         logger.debug(f"There was an error executing the workflow '{workflow_id}'")
         raise HTTPException(status_code=500, detail=f"Missing key '{err.args[0]}'")
 
-    workflow = await WorkflowManager().find_one(db, username=username, workflow_id=workflow_id)
-
     return workflow
 
 
@@ -421,12 +551,14 @@ async def revoke(
     """
     Revoke workflow execution.
     """
-    user_by_username = await get_user_by_username(db, username)
+    # get user and workflow from db, both lookups are independent
+    user_by_username, workflow = await asyncio.gather(
+        get_user_by_username(db, username),
+        workflow_manager.find_one(db, username=username, workflow_id=workflow_id),
+    )
     if not user_by_username:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Username not found")
 
-    # get workflow from db
-    workflow = await WorkflowManager().find_one(db, username=username, workflow_id=workflow_id)
     if not workflow:
         raise HTTPException(status_code=404, detail=f"Workflow {workflow_id} not found")
 
@@ -434,4 +566,4 @@ async def revoke(
     if not workflow.executed:
         raise HTTPException(status_code=404, detail=f"Workflow has not been executed yet")
 
-    await WorkflowManager().revoke(workflow)
+    await workflow_manager.revoke(db, workflow)
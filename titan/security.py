@@ -1,3 +1,5 @@
+import hmac
+
 from fastapi import HTTPException, Security
 from fastapi.security import APIKeyCookie, APIKeyHeader, APIKeyQuery
 from starlette.status import HTTP_403_FORBIDDEN
@@ -8,6 +10,15 @@ api_key_query = APIKeyQuery(name=settings.API_KEY_NAME, auto_error=False)
 api_key_header = APIKeyHeader(name=settings.API_KEY_NAME, auto_error=False)
 api_key_cookie = APIKeyCookie(name=settings.API_KEY_NAME, auto_error=False)
 
+_api_key_bytes = settings.API_KEY.encode()
+
+
+def _is_valid(api_key: str) -> bool:
+    """
+    Compares given key with the API key in constant time.
+    """
+    return api_key is not None and hmac.compare_digest(api_key.encode(), _api_key_bytes)
+
 
 async def get_api_key(
     api_key_query: str = Security(api_key_query),
@@ -20,11 +31,11 @@ async def get_api_key(
     * Header value
     * Cookie
     """
-    if api_key_query == settings.API_KEY:
+    if _is_valid(api_key_query):
         return api_key_query
-    elif api_key_header == settings.API_KEY:
+    elif _is_valid(api_key_header):
         return api_key_header
-    elif api_key_cookie == settings.API_KEY:
+    elif _is_valid(api_key_cookie):
         return api_key_cookie
     else:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Invalid access token")
@@ -1,4 +1,6 @@
-from typing import List
+import asyncio
+import functools
+from typing import Dict, List, Tuple
 
 from aiocache import cached
 
@@ -8,6 +10,7 @@ from titan.semantic.repository import RDFRepository
 logger = get_logger(__name__)
 
 
+@functools.lru_cache(maxsize=4096)
 def get_name(uri: str) -> str:
     """
     Splits an URI and returns the individual name.
@@ -15,46 +18,91 @@ def get_name(uri: str) -> str:
     return uri.split("/")[-1]
 
 
+# variables identifying a single component in `GET_COMPONENTS` results
+_COMPONENT_VARIABLES = ("individual", "type", "label", "description", "ninputs", "noutputs")
+
+
+# max. number of components bound in a single `VALUES` query
+VALUES_BATCH_SIZE = 50
+
+
+def _connection(individual_uri: str, individual_type: str) -> dict:
+    """
+    Builds an input or output class of a component.
+    """
+    return {
+        "properties": {"name": get_name(individual_uri)},
+        "definition": {
+            "uri": individual_uri,
+            "type": individual_type,
+        },
+    }
+
+
+def _components_key(
+    f, self, component_type: str = None, include_parameters: bool = False, include_connections: bool = False
+) -> str:
+    """
+    Cache key of `BIGOWL.components`, the same regardless of how arguments are passed.
+    """
+    return f"bigowl:{self.db.endpoint}:components:{component_type}:{include_parameters:d}:{include_connections:d}"
+
+
+def _uri_key(f, self, uri: str) -> str:
+    """
+    Cache key of `BIGOWL` methods taking a single URI.
+    """
+    return f"bigowl:{self.db.endpoint}:{f.__name__}:{uri}"
+
+
 class BIGOWLQueries:
     GET_COMPONENTS = """
-        SELECT DISTINCT ?individual ?type ?label ?description ?ninputs ?noutputs
+        SELECT DISTINCT ?individual ?type ?label ?description ?ninputs ?noutputs ?language ?module
         WHERE {{
             ?individual rdf:type ?type. 
             ?type rdfs:subClassOf* <http://www.ontologies.khaos.uma.es/bigowl/{type}>. 
             OPTIONAL {{ ?individual rdfs:label ?label . }} .
             OPTIONAL {{ ?individual rdfs:comment ?description . }} .
             OPTIONAL {{ ?individual bigowl:numberOfInputs ?ninputs. }} .
-            OPTIONAL {{ ?individual bigowl:numberOfOutputs ?noutputs. }}
+            OPTIONAL {{ ?individual bigowl:numberOfOutputs ?noutputs. }} .
+            OPTIONAL {{
+                ?individual bigowl:hasImplementation ?implementation.
+                ?implementation bigowl:implementationLanguage ?language .
+                ?implementation bigowl:module ?module .
+            }}
         }} 
     """
     GET_PARAMETERS = """
-        SELECT ?param ?type ?label ?name ?range ?defaultValue
+        SELECT ?component ?param ?type ?label ?name ?range ?defaultValue
         WHERE {{
-            <{component}> bigowl:hasParameter ?param .
+            VALUES ?component {{ {values} }}
+            ?component bigowl:hasParameter ?param .
             ?param bigowl:hasDataType ?type .
             OPTIONAL {{ ?param rdfs:label ?label . }} .
             OPTIONAL {{ ?param bigowl:hasName ?name. }} .
             OPTIONAL {{ ?param bigowl:hasRange ?range . }} .
-            OPTIONAL {{ ?param bigowl:hasDefaultValue ?defaultValue . }}            
+            OPTIONAL {{ ?param bigowl:hasDefaultValue ?defaultValue . }}
         }}
     """
     GET_INPUT_CLASSES = """
-        SELECT DISTINCT ?in ?type ?name 
+        SELECT DISTINCT ?component ?in ?type ?name
         WHERE {{
-            <{component}> bigowl:specifiesInputClass ?in .
-            ?in rdf:type ?type . 
+            VALUES ?component {{ {values} }}
+            ?component bigowl:specifiesInputClass ?in .
+            ?in rdf:type ?type .
             OPTIONAL {{ ?in rdfs:label ?name . }} .
             FILTER (?type != owl:NamedIndividual)
-        }} 
+        }}
     """
     GET_OUTPUT_CLASSES = """
-        SELECT DISTINCT ?out ?type ?name
+        SELECT DISTINCT ?component ?out ?type ?name
         WHERE {{
-            <{component}> bigowl:specifiesOutputClass ?out .
-            ?out rdf:type ?type . 
+            VALUES ?component {{ {values} }}
+            ?component bigowl:specifiesOutputClass ?out .
+            ?out rdf:type ?type .
             OPTIONAL {{ ?out rdfs:label ?name . }} .
             FILTER (?type != owl:NamedIndividual)
-        }} 
+        }}
     """
     GET_COMPATIBLE_COMPONENTS = """
         SELECT DISTINCT ?component2 ?label ?classComponent2
@@ -70,14 +118,6 @@ class BIGOWLQueries:
             FILTER (?type!=owl:NamedIndividual)
         }}
     """
-    GET_IMPLEMENTATION = """
-        SELECT ?language ?module
-        WHERE {{
-            <{component}> bigowl:hasImplementation ?implementation.
-            ?implementation bigowl:implementationLanguage ?language .
-            ?implementation bigowl:module ?module .
-        }}
-    """
     GET_PARENTS = """
         SELECT ?parent
         WHERE {{ 
@@ -136,7 +176,7 @@ class BIGOWL:
     def __init__(self, db: RDFRepository):
         self.db = db
 
-    @cached(ttl=3600)
+    @cached(ttl=3600, key_builder=_components_key)
     async def components(
         self,
         component_type: str = None,
@@ -146,52 +186,50 @@ class BIGOWL:
         """
         Returns components on the database (including the number of entities found).
         """
-        operators = []
-
         if not component_type:
             components = await self.db.query(query=BIGOWLQueries.GET_COMPONENTS, type="Component")
         else:
             components = await self.db.query(query=BIGOWLQueries.GET_COMPONENTS, type=component_type)
 
-        for component in components:
-            individual_uri = component["individual"]["value"]
-            individual_name = get_name(individual_uri)
-
-            # optional fields
-            label = component.get("label", {}).get("value", individual_name)
-            description = component.get("description", {}).get("value")
+        # implementations come as one row each, group them back by component
+        grouped = {}
 
-            # properties
-            module_implementations = []
-            implementations = await self.db.query(query=BIGOWLQueries.GET_IMPLEMENTATION, component=individual_uri)
+        for row in components:
+            key = tuple(row.get(var, {}).get("value") for var in _COMPONENT_VARIABLES)
+            _, module_implementations = grouped.setdefault(key, (row, []))
+            if "language" in row and "module" in row:
+                module_implementations.append({"language": row["language"]["value"], "module": row["module"]["value"]})
 
-            for imp in implementations:
-                try:
-                    module_implementations.append(
-                        {
-                            "language": imp["language"]["value"],
-                            "module": imp["module"]["value"],
-                        }
-                    )
-                except:
-                    logger.exception(f"Could not parse implementation: {imp}")
+        # parameters and ins/outs of every component are fetched at once
+        uris = list(dict.fromkeys(component["individual"]["value"] for component, _ in grouped.values()))
 
-            # optional: parameters
-            parameters = []
+        async def _parameters() -> Dict[str, list]:
             if include_parameters:
                 try:
-                    parameters = await self.parameters(individual_uri)
+                    return await self._parameters_of(uris)
                 except:
                     logger.exception("Could not parse parameters")
+            return {}
 
-            # optional: ins/outs
-            inputs, outputs = [], []
+        async def _connections() -> Tuple[Dict[str, list], Dict[str, list]]:
             if include_connections:
                 try:
-                    inputs = await self.inputs(individual_uri)
-                    outputs = await self.outputs(individual_uri)
+                    return await asyncio.gather(self._inputs_of(uris), self._outputs_of(uris))
                 except:
                     logger.exception("Could not parse connections")
+            return {}, {}
+
+        parameters, (inputs, outputs) = await asyncio.gather(_parameters(), _connections())
+
+        operators = []
+
+        for component, module_implementations in grouped.values():
+            individual_uri = component["individual"]["value"]
+            individual_name = get_name(individual_uri)
+
+            # optional fields
+            label = component.get("label", {}).get("value", individual_name)
+            description = component.get("description", {}).get("value")
 
             operators.append(
                 {
@@ -201,12 +239,12 @@ class BIGOWL:
                         "label": label,
                         "description": description,
                         "module": module_implementations,
-                        "ninputs": len(inputs),
-                        "noutputs": len(outputs),
+                        "ninputs": len(inputs.get(individual_uri, [])),
+                        "noutputs": len(outputs.get(individual_uri, [])),
                         # optional
-                        "parameters": parameters,
-                        "inputs": inputs,
-                        "outputs": outputs,
+                        "parameters": parameters.get(individual_uri, []),
+                        "inputs": inputs.get(individual_uri, []),
+                        "outputs": outputs.get(individual_uri, []),
                     },
                     "definition": {
                         "uri": individual_uri,
@@ -217,6 +255,7 @@ class BIGOWL:
 
         return {component_type: {"operators": operators, "total": len(operators)}}
 
+    @cached(ttl=3600, key_builder=_uri_key)
     async def compatible(self, uri: str) -> dict:
         """
         Returns compatible components of a particular component (including the total number of entities).
@@ -245,17 +284,26 @@ class BIGOWL:
 
         return {"compatible_components": operators, "total": len(operators)}
 
+    @cached(ttl=3600, key_builder=_uri_key)
     async def parameters(self, uri: str) -> list:
         """
         Returns the parameters of a particular component.
         """
-        params = []
-        parameters = await self.db.query(query=BIGOWLQueries.GET_PARAMETERS, component=uri)
+        parameters = await self._parameters_of([uri])
+        return parameters.get(uri, [])
+
+    async def _parameters_of(self, uris: List[str]) -> Dict[str, list]:
+        """
+        Returns the parameters of several components, by component.
+        """
+        parameters = await self.db.query_batched(
+            BIGOWLQueries.GET_PARAMETERS, "component", uris, batch_size=VALUES_BATCH_SIZE
+        )
 
         logger.debug(parameters)
 
-        for p in parameters:
-            params.append(
+        return {
+            uri: [
                 {
                     "properties": {
                         "name": p.get("name", {}).get("value"),
@@ -268,65 +316,64 @@ class BIGOWL:
                         "type": p["type"]["value"],
                     },
                 }
-            )
-
-        return params
+                for p in rows
+            ]
+            for uri, rows in parameters.items()
+        }
 
+    @cached(ttl=3600, key_builder=_uri_key)
     async def inputs(self, uri: str) -> list:
         """
         Returns the input(s) of a particular component.
         """
-        inns = []
-        inputs = await self.db.query(query=BIGOWLQueries.GET_INPUT_CLASSES, component=uri)
+        inputs = await self._inputs_of([uri])
+        return inputs.get(uri, [])
 
-        logger.debug(inputs)
-
-        for inn in inputs:
-            individual_uri = inn["in"]["value"]
-            individual_name = get_name(individual_uri)
+    async def _inputs_of(self, uris: List[str]) -> Dict[str, list]:
+        """
+        Returns the input(s) of several components, by component.
+        """
+        inputs = await self.db.query_batched(
+            BIGOWLQueries.GET_INPUT_CLASSES, "component", uris, batch_size=VALUES_BATCH_SIZE
+        )
 
-            inns.append(
-                {
-                    "properties": {"name": individual_name},
-                    "definition": {
-                        "uri": individual_uri,
-                        "type": inn["type"]["value"],
-                    },
-                }
-            )
+        logger.debug(inputs)
 
-        return inns
+        return {
+            uri: [_connection(inn["in"]["value"], inn["type"]["value"]) for inn in rows]
+            for uri, rows in inputs.items()
+        }
 
+    @cached(ttl=3600, key_builder=_uri_key)
     async def outputs(self, uri: str) -> list:
         """
         Returns the output(s) of a particular component.
         """
-        outs = []
-        outputs = await self.db.query(query=BIGOWLQueries.GET_OUTPUT_CLASSES, component=uri)
+        outputs = await self._outputs_of([uri])
+        return outputs.get(uri, [])
 
-        logger.debug(outputs)
-
-        for out in outputs:
-            individual_uri = out["out"]["value"]
-            individual_name = get_name(individual_uri)
+    async def _outputs_of(self, uris: List[str]) -> Dict[str, list]:
+        """
+        Returns the output(s) of several components, by component.
+        """
+        outputs = await self.db.query_batched(
+            BIGOWLQueries.GET_OUTPUT_CLASSES, "component", uris, batch_size=VALUES_BATCH_SIZE
+        )
 
-            outs.append(
-                {
-                    "properties": {"name": individual_name},
-                    "definition": {
-                        "uri": individual_uri,
-                        "type": out["type"]["value"],
-                    },
-                }
-            )
+        logger.debug(outputs)
 
-        return outs
+        return {
+            uri: [_connection(out["out"]["value"], out["type"]["value"]) for out in rows]
+            for uri, rows in outputs.items()
+        }
 
+    @cached(ttl=3600, key_builder=_uri_key)
     async def parents(self, uri: str) -> List[str]:
         """
         Returns the parent(s) of a connection.
         """
-        parents = await self.db.query(query=BIGOWLQueries.GET_PARENTS, individual=uri)
+        # parents are plain IRIs, fetched in the more compact CSV format
+        parents = await self.db.query(query=BIGOWLQueries.GET_PARENTS, individual=uri, result_format="csv")
         logger.debug(parents)
 
         return [parent["parent"]["value"] for parent in parents]
@@ -335,7 +382,8 @@ class BIGOWL:
         """
         Check for invalid connected components.
         """
-        invalid = await self.db.query(query=BIGOWLQueries.ARE_COMPONENTS_FROM_WORKFLOW_VALID, workflow=uri)
+        # workflows are rewritten on every update, so their triples are read uncached
+        invalid = await self.db.query(query=BIGOWLQueries.ARE_COMPONENTS_FROM_WORKFLOW_VALID, cache=False, workflow=uri)
         results = []
 
         for pair in invalid:
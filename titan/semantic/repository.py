@@ -1,14 +1,56 @@
+import asyncio
+import csv
+import functools
+import hashlib
+import io
+import logging
+import random
 import re
 from abc import ABC, abstractmethod
-from typing import Dict
+from typing import Dict, List, Optional
 
+import httpcore
 import httpx
+import orjson
+from aiocache import SimpleMemoryCache
 from httpx import Response
 
 from titan.logger import get_logger
 
 logger = get_logger(__name__)
 
+# literals and IRIs are matched first so that their contents are left untouched
+QUERY_TOKENS_PATTERN = re.compile(
+    r'''("""(?:[^"\\]|\\.|"(?!""))*"""'''
+    r"""|'''(?:[^'\\]|\\.|'(?!''))*'''"""
+    r'''|"(?:[^"\\\n]|\\.)*"'''
+    r"""|'(?:[^'\\\n]|\\.)*'"""
+    r'''|<[^<>"{}|^`\\\s]*>)'''
+    r"|(?:\s|#[^\n]*)+"
+)
+
+
+def _replace_token(match: re.Match) -> str:
+    return match.group(1) or " "
+
+
+@functools.lru_cache(maxsize=256)
+def _normalize(query: str) -> str:
+    """
+    Removes comments from a query template and collapses whitespace outside literals and IRIs, once per template.
+    """
+    return QUERY_TOKENS_PATTERN.sub(_replace_token, query).strip()
+
+
+def _parse_csv(text: str) -> List[dict]:
+    """
+    Parses SPARQL results in CSV format into bindings shaped as the JSON ones, i.e., `{variable: {"value": value}}`.
+    Datatypes and languages are not part of the format, and unbound variables are left out.
+    """
+    reader = csv.reader(io.StringIO(text))
+    variables = next(reader, [])
+    return [{variable: {"value": value} for variable, value in zip(variables, row) if value} for row in reader]
+
 
 class RDFRepository(ABC):
     def __init__(self, endpoint: str, database: str, username: str = None, password: str = None):
@@ -18,111 +60,233 @@ class RDFRepository(ABC):
         self.password = password
 
     @abstractmethod
-    async def query(self, query: str, **params) -> dict:
+    async def query(self, query: str, result_format: str = "json", cache: bool = True, **params) -> dict:
         """
-        Performs a query against the database.
+        Performs a query against the database, requesting results either as "json" or, more compact, as "csv".
+        Results are cached unless `cache` is false, e.g., for queries on data that is written often.
         """
         pass
 
     @abstractmethod
-    async def update(self, query: str) -> None:
+    async def update(self, query: str, invalidate: bool = True) -> None:
         """
-        Performs an update query against the database.
+        Performs an update query against the database. Cached query results are discarded, unless `invalidate` is
+        false, i.e., the update only touches data no cached query reads.
         """
         pass
 
+    async def query_batched(
+        self, query: str, variable: str, iris: List[str], batch_size: int = 50, **params
+    ) -> Dict[str, list]:
+        """
+        Performs a query binding `variable` to the given IRIs, through a `VALUES ?variable {{ {values} }}` clause, with
+        one request per batch of `batch_size` IRIs. Returns the resulting rows grouped by the IRI they were bound to.
+        """
+        batches = [iris[i : i + batch_size] for i in range(0, len(iris), batch_size)]
+        results = await asyncio.gather(
+            *(self.query(query=query, values=" ".join(f"<{iri}>" for iri in batch), **params) for batch in batches)
+        )
+
+        rows_by_iri = {}
+        for rows in results:
+            for row in rows:
+                rows_by_iri.setdefault(row[variable]["value"], []).append(row)
+        return rows_by_iri
+
 
 class Virtuoso(RDFRepository):
     """
     Async SPARQLWrapper for Virtuoso graph store.
     """
 
-    COMMENTS_PATTERN = re.compile(r"(^|\n)\s*#.*?\n")
+    # seconds query results are kept for, until an update is performed
+    QUERY_CACHE_TTL = 300
 
-    def __init__(self, endpoint: str, database: str, username: str = None, password: str = None):
+    # longer queries are sent as an url-encoded form instead, to avoid hitting url length limits
+    MAX_GET_QUERY_LENGTH = 2000
+
+    # queries failing with transient errors are retried, waiting a random time up to an exponential backoff
+    MAX_QUERY_ATTEMPTS = 3
+    RETRY_BACKOFF = 0.05
+    MAX_RETRY_BACKOFF = 1.0
+
+    def __init__(
+        self,
+        endpoint: str,
+        database: str,
+        username: str = None,
+        password: str = None,
+        http2: bool = False,
+        max_concurrency: int = 32,
+        auth_scheme: str = "digest",
+        transport: Optional[httpcore.AsyncHTTPTransport] = None,
+    ):
         super().__init__(endpoint, database, username, password)
 
+        if auth_scheme not in ("digest", "basic"):
+            raise ValueError(f"Unsupported auth scheme {auth_scheme}")
+
+        self.http2 = http2
+        self.auth_scheme = auth_scheme
+        # alternative transport for the shared client, e.g., a faster or instrumented one
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+
         self.parameters: Dict[str, str] = {}
         self.headers: Dict[str, str] = {}
 
+        self._client: Optional[httpx.AsyncClient] = None
+        # created on first request, as it must belong to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        # results are shared by every instance pointing to the same graph, so that an update through any of them
+        # invalidates them
+        self._cache_namespace = f"virtuoso:{endpoint}:{database}:"
+        self._cache = SimpleMemoryCache(namespace=self._cache_namespace)
+
         self._setup_request()
 
     def _setup_request(self) -> None:
         self._add_parameter("default-graph-uri", self.database)
-        self._add_parameter("User-Agent", "salon")
 
+        self._add_header("User-Agent", "salon")
         self._add_header(
             "Accept",
             "application/sparql-results+json,application/json,text/javascript,application/javascript",
         )
 
-    async def query(self, query: str, **params) -> dict:
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Returns the shared client, so that connections to the store are pooled and kept alive across queries.
+        """
+        if self._client is None:
+            # basic auth saves the challenge round-trip of digest auth, for stores reached over trusted links or TLS
+            if self.auth_scheme == "basic":
+                auth = httpx.BasicAuth(self.username, self.password)
+            else:
+                auth = httpx.DigestAuth(self.username, self.password)
+            self._client = httpx.AsyncClient(
+                auth=auth,
+                # base headers are set once, requests only carry the ones they override
+                headers=self.headers,
+                http2=self.http2,
+                transport=self.transport,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """
+        Closes the shared client, if any.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    async def query(self, query: str, result_format: str = "json", cache: bool = True, **params) -> dict:
         """
         Run 'SELECT' query with http Auth DIGEST and return results in JSON format.
         Protocol details at http://www.w3.org/TR/sparql11-protocol/#query-operation
+
+        Results of queries whose variables are all IRIs or plain literals can be requested as CSV instead, which is
+        smaller on the wire and cheaper to parse. Bindings are returned in the same shape, without datatypes.
         """
-        query_string = query.format(**params)
-        query_string = re.sub(self.COMMENTS_PATTERN, "\n\n", query_string)
+        if result_format not in ("json", "csv"):
+            raise ValueError(f"Unsupported result format {result_format}")
 
-        self._add_parameter("query", query_string)
-        req = await self._get()
+        # template is normalized rather than the final query, so that it is done once per template
+        query_string = _normalize(query).format(**params)
 
-        # convert to json and return bindings
+        key = hashlib.blake2b(f"{result_format}:{query_string}".encode(), digest_size=16).hexdigest()
+        result = await self._cache.get(key) if cache else None
+        if result is not None:
+            return result
+
+        # parameters and headers are built per call, so that concurrent queries sharing this instance do not interfere
+        params = {**self.parameters, "query": query_string}
+        headers = None if result_format == "json" else {"Accept": "text/csv"}
+        if len(query_string) > self.MAX_GET_QUERY_LENGTH:
+            req = await self._post_form(params, headers=headers)
+        else:
+            req = await self._get(params=params, headers=headers)
+
+        # convert to json and return bindings, failed requests are not cached
         result = {}
         if not req.is_error:
-            result = req.json()
-            result = result["results"]["bindings"]
-
-        self._remove_parameter("query")
+            if result_format == "json":
+                result = orjson.loads(req.content)
+                result = result["results"]["bindings"]
+            else:
+                result = _parse_csv(req.text)
+            if cache:
+                await self._cache.set(key, result, ttl=self.QUERY_CACHE_TTL)
 
         return result
 
-    async def update(self, query: str) -> None:
+    async def update(self, query: str, invalidate: bool = True) -> None:
         """
         Run 'INSERT' update query with http Auth DIGEST.
         Protocol details at http://www.w3.org/TR/sparql11-protocol/#update-operation
         """
-        self._add_header("Content-Type", "application/sparql-update")
+        # headers are built per call, so that concurrent requests sharing this instance do not interfere
+        headers = {"Content-Type": "application/sparql-update"}
 
-        req = await self._post_directly(query)
+        req = await self._post_directly(query, headers=headers)
+
+        # results of previous queries may no longer hold
+        if invalidate:
+            await self._cache.clear(namespace=self._cache_namespace)
+
+        # failed updates are raised, so that callers can tell whether their triples were written
+        req.raise_for_status()
 
         # convert to json and return bindings
-        result = {}
-        if not req.is_error:
-            result = req.json()
-            result = result["results"]["bindings"]
+        result = orjson.loads(req.content)
+        return result["results"]["bindings"]
 
-        self._remove_header("Content-Type")
+    async def _post_directly(self, query: str, headers: Dict[str, str] = None, **kwargs) -> Response:
+        return await self._request("POST", data=query, params=self.parameters, headers=headers, timeout=12000)
 
-        return result
+    async def _post_form(self, params: Dict[str, str], headers: Dict[str, str] = None) -> Response:
+        return await self._request("POST", retry=True, data=params, headers=headers)
 
-    async def _post_directly(self, query: str, **kwargs) -> Response:
-        auth = httpx.DigestAuth(self.username, self.password)
-        async with httpx.AsyncClient(timeout=12000) as client:
-            req = await client.post(
-                self.endpoint,
-                data=query,
-                params=self.parameters,
-                headers=self.headers,
-                auth=auth,
-            )
-        if req.is_error:
-            print(req.text, req.status_code)
-        return req
+    async def _get(self, params: Dict[str, str] = None, headers: Dict[str, str] = None, **kwargs) -> Response:
+        return await self._request("GET", retry=True, params=params or self.parameters, headers=headers)
+
+    async def _request(self, method: str, retry: bool = False, **kwargs) -> Response:
+        """
+        Sends a request to the store. Unless it is an update, transport errors and server errors are retried with
+        exponential backoff and jitter.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        attempts = self.MAX_QUERY_ATTEMPTS if retry else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                # bounds requests in flight, so that fan-outs do not exhaust the store's threads
+                async with self._semaphore:
+                    req = await self._get_client().request(method, self.endpoint, **kwargs)
+            except httpx.TransportError as err:
+                if attempt == attempts:
+                    raise
+                logger.warning("Request to %s failed (%r), retrying", self.endpoint, err)
+            else:
+                if req.status_code < 500 or attempt == attempts:
+                    break
+                logger.warning("Request to %s failed with status %d, retrying", self.endpoint, req.status_code)
+            await asyncio.sleep(random.uniform(0, min(self.MAX_RETRY_BACKOFF, self.RETRY_BACKOFF * 2 ** attempt)))
 
-    async def _get(self, **kwargs) -> Response:
-        auth = httpx.DigestAuth(self.username, self.password)
-        async with httpx.AsyncClient() as client:
-            req = await client.get(
-                self.endpoint,
-                params=self.parameters,
-                headers=self.headers,
-                auth=auth,
-            )
         if req.is_error:
-            logger.error(req.text, req.status_code)
+            self._log_error(req)
         return req
 
+    def _log_error(self, req: Response) -> None:
+        # the response body is only decoded if the record is going to be emitted
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error("Request to %s failed with status %d: %s", self.endpoint, req.status_code, req.text[:512])
+
     def _add_header(self, param: str, value: str) -> None:
         """
         Adds new custom header to request.
@@ -152,3 +316,142 @@ class Virtuoso(RDFRepository):
             del self.parameters[param]
         except KeyError:
             pass
+
+
+class RDFBatchWriter:
+    """
+    Buffers blocks of RDF n-triples and writes them to the repository in batches, i.e., with a single
+    'INSERT DATA' update per batch instead of one update per block.
+
+    A batch is written when `max_batch_size` blocks have been buffered or `flush_interval` seconds after its first
+    block arrived, whichever comes first. Until `start()` is called, blocks are written right away. If a batch
+    cannot be written, its blocks are written one by one so that a single malformed block does not drop the rest.
+
+    At most `max_queue_size` blocks (by default, four batches) are held in memory: beyond that, `put()` waits for
+    room, so that a slow or unavailable repository slows down writers instead of piling up blocks.
+
+    Workflow triples are only read by uncached queries, so writes keep the results of cached ones, e.g., those on the
+    ontology, instead of discarding them with every batch.
+    """
+
+    # mark the end of the queue when closing, and the end of the current batch when flushing
+    _STOP = object()
+    _FLUSH = object()
+
+    def __init__(
+        self,
+        store: RDFRepository,
+        max_batch_size: int = 100,
+        flush_interval: float = 0.5,
+        close_timeout: float = 10.0,
+        max_queue_size: Optional[int] = None,
+    ):
+        self.store = store
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.close_timeout = close_timeout
+        self.max_queue_size = max_queue_size or 4 * max_batch_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Future] = None
+
+    async def start(self) -> None:
+        """
+        Starts writing batches in the background.
+        """
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._task = asyncio.ensure_future(self._run())
+
+    async def flush(self) -> None:
+        """
+        Writes every block queued so far right away, without waiting for their batch to fill up or its interval to
+        elapse, and waits until they are written.
+        """
+        if self._task is not None:
+            await self._queue.put(self._FLUSH)
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """
+        Writes every pending block and stops the background task, waiting at most `close_timeout` seconds.
+        """
+        if self._task is not None:
+            task, self._task = self._task, None
+
+            async def _stop():
+                # blocks queued from now on are written right away, waiting for room in a full queue is bounded too
+                await self._queue.put(self._STOP)
+                await asyncio.shield(task)
+
+            try:
+                await asyncio.wait_for(_stop(), self.close_timeout)
+            except asyncio.TimeoutError:
+                task.cancel()
+                pending = 0
+                while not self._queue.empty():
+                    if self._queue.get_nowait() not in (self._STOP, self._FLUSH):
+                        pending += 1
+                logger.error(
+                    "RDF batch writer did not finish in time, %d queued block(s) and the batch being written were lost",
+                    pending,
+                )
+
+    async def put(self, triples: str) -> None:
+        """
+        Schedules a block of n-triples to be written, waiting for room if too many are already queued.
+        """
+        if self._task is None:
+            await self._write([triples])
+        else:
+            await self._queue.put(triples)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        stopped = False
+        while not stopped:
+            block = await self._queue.get()
+            if block is self._STOP or block is self._FLUSH:
+                self._queue.task_done()
+                stopped = block is self._STOP
+                continue
+            batch = [block]
+            # markers read while filling the batch are acknowledged along with it, once it is written
+            markers = 0
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    block = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if block is self._STOP or block is self._FLUSH:
+                    markers += 1
+                    stopped = block is self._STOP
+                    break
+                batch.append(block)
+            await self._write(batch)
+            for _ in range(len(batch) + markers):
+                self._queue.task_done()
+
+    def _insert(self, batch: List[str]) -> str:
+        return "INSERT DATA { GRAPH <" + self.store.database + "> {" + "".join(batch) + "} }"
+
+    async def _write(self, batch: List[str]) -> None:
+        logger.debug("Writing batch of %d block(s) to repository", len(batch))
+        try:
+            await self.store.update(self._insert(batch), invalidate=False)
+            return
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Could not store RDF block")
+                return
+            logger.warning("Could not store RDF batch of %d blocks, writing them one by one", len(batch), exc_info=True)
+
+        for block in batch:
+            try:
+                await self.store.update(self._insert([block]), invalidate=False)
+            except Exception:
+                logger.exception("Could not store RDF block")